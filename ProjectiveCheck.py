@@ -2,128 +2,94 @@
 # -*- coding: utf-8 -*_
 # Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
 
-import os
-import sys
 import codecs
+import argparse
+
+from structure.data_iter import open_corpus
+from structure.binary import BinaryCorpus
+from structure.tree_check import check_heads, heads_of_lines
+
+
+def check_lines(lines, single_root=False):
+    """
+    :return: (is valid, report) of a sentence given as split conll lines.
+    """
+    try:
+        result = check_heads(heads_of_lines(lines))
+    except (ValueError, IndexError) as e:
+        return False, 'bad line: %s' % e
+    if not result.acyclic:
+        return False, 'cycle or head out of range'
+    if single_root and not result.roots == 1:
+        return False, '%d roots' % result.roots
+    if result.non_projective:
+        return False, 'non-projective arcs: ' + ' '.join(['%d->%d' % arc for arc in result.non_projective])
+    return True, ''
+
+
+def convert(in_file, out_file, single_root=False, report=False):
+    with codecs.open(out_file, 'w', encoding='utf8') as fo:
+        for lines in open_corpus(in_file):
+            valid, reason = check_lines(lines, single_root)
+            if not valid:
+                fo.write('*****\n')
+                if report:
+                    fo.write('# ' + reason + '\n')
+                fo.write('\n'.join(['\t'.join(i) for i in lines]) + '\n')
+
+
+def sentence_text(corpus, i):
+    """
+    the i-th sentence as convert writes it: its stripped non empty lines, the fields are not split again.
+    """
+    return '\n'.join([line.strip() for line in corpus.raw(i).decode('utf8').splitlines() if line.strip() != ''])
+
+
+def convert_batch(in_file, out_file, single_root=False, report=False, batch_size=2000):
+    """
+    same output as convert, the heads of batch_size sentences are checked at once with numpy.
+    a batch with a malformed line is checked sentence by sentence.
+    """
+    import numpy as np
+    from structure.batch_check import pack_spans, validate_batch
+    corpus = open_corpus(in_file)
+    if not isinstance(corpus, BinaryCorpus):
+        all_starts = np.frombuffer(corpus.starts, dtype=np.uint64).astype(np.int64)
+        all_ends = np.frombuffer(corpus.ends, dtype=np.uint64).astype(np.int64)
+    with codecs.open(out_file, 'w', encoding='utf8') as fo:
+        for begin in range(0, len(corpus), batch_size):
+            end = min(begin + batch_size, len(corpus))
+            try:
+                if isinstance(corpus, BinaryCorpus):
+                    index, heads, offsets = corpus.head_batch(begin, end)
+                else:
+                    base = int(all_starts[begin])
+                    index, heads, offsets = pack_spans(corpus.mm[base:int(all_ends[end - 1])],
+                                                       all_starts[begin:end] - base, all_ends[begin:end] - base)
+                valid = validate_batch(heads, offsets, index, single_root)[0]
+            except (ValueError, IndexError):
+                valid = [check_lines(corpus[i], single_root)[0] for i in range(begin, end)]
+            failed = []
+            for i in np.flatnonzero(np.logical_not(valid)) + begin:
+                failed.append('*****\n')
+                if report:
+                    failed.append('# ' + check_lines(corpus[i], single_root)[1] + '\n')
+                failed.append(sentence_text(corpus, i) + '\n')
+            fo.write(''.join(failed))
 
-SPLIT_CHAR = '\t'
-
-class Word(object):
-    __idx_index = 0
-    __word_index = 1
-    __parent_index = 6
-    def __init__(self, line):
-        self.line = line
-        self.index = int(line[self.__idx_index]) if self.__idx_index < len(line) else None
-        self.word = line[self.__word_index] if self.__word_index < len(line) else None
-        self.parent = int(line[self.__parent_index]) if self.__parent_index < len(line) else None
-        self.next = None
-        self.pre = None
-        self.children = []
-        self.left_children = []
-        self.right_children = []
-
-    def __str__(self):
-        if self.parent is None: # skip root
-            return ''
-        self.line[self.__idx_index] = str(self.index)
-        self.line[self.__word_index] = self.word
-        self.line[self.__parent_index] = str(self.parent.index)
-        return SPLIT_CHAR.join(self.line) + '\n'
-
-    def reach_and_reach_children(self, reach, maxdeep, depth=0):
-        reach[self.index] = True
-        if depth > maxdeep:
-            raise RuntimeError('circle in tree.')
-        for word in self.children:
-            word.reach_and_reach_children(reach, maxdeep, depth + 1)
-
-    def check_projective(self):
-        if self.parent.index < self.index:
-            min = self.parent.index
-            max = self.index
-            next = 'pre'
-        else:
-            min = self.index
-            max = self.parent.index
-            next = 'next'
-        cur = self.__getattribute__(next)
-        while not (cur.index == self.parent.index):
-            if cur.parent.index < min or cur.parent.index > max:
-                return False
-            cur = cur.__getattribute__(next)
-        return True
-
-class Sentence(object):
-
-    def __init__(self):
-        self.root = Word(['0', '<ROOT>'])
-
-    def init(self, stn):
-        words = [self.root]
-        for i in stn:
-            words.append(Word(i))
-        # manage parents
-        for i in words:
-            i.parent = words[i.parent] if i.parent is not None else None
-        # manage pre next children
-        for i in words:
-            i.next = words[i.index + 1] if i.index + 1 < len(words) else None
-            i.pre = words[i.index - 1] if i.index - 1 >= 0 else None
-            if not i.parent is None:
-                i.parent.children.append(i)
-
-    def re_index(self):
-        i = 0
-        for w in self.iter_item():
-            w.index = i
-            i += 1
-
-    def iter_item(self):
-        cur = self.root
-        while cur is not None:
-            yield cur
-            cur = cur.next
-
-    def check_tree(self):
-        l = len(self)
-        reach = [False] * l
-        self.root.reach_and_reach_children(reach, l)
-        return all(reach)
-
-    def check_projective(self):
-        for w in self.iter_item():
-            if w.word == '<ROOT>':
-                continue
-            if not w.check_projective():
-                return False
-        return True
-
-    def __len__(self):
-        return len([1 for i in self.iter_item()])
-
-    def __str__(self):
-        return ''.join([str(i) for i in self.iter_item()])
-
-def convert(in_file, out_file):
-    with codecs.open(in_file, encoding='utf8') as fi:
-        with codecs.open(out_file, 'w', encoding='utf8') as fo:
-            lines = []
-            for i in fi:
-                i = i.strip()
-                if (i == '' or i.startswith('#')) and len(lines):
-                    try:
-                        stn = Sentence()
-                        stn.init(lines)
-                        if not (stn.check_tree() and stn.check_projective()):
-                            fo.write('*****\n')
-                            fo.write('\n'.join(['\t'.join(i) for i in lines]) + '\n')
-                    except:
-                        fo.write('*****\n')
-                        fo.write('\n'.join(['\t'.join(i) for i in lines]) + '\n')
-                    lines = []
-                elif not (i == '' or i.startswith('#')):
-                    lines.append(i.split('\t'))
 
 if __name__ == '__main__':
-    convert(sys.argv[1], sys.argv[2])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='output the sentences which are not a projective tree.')
+    parser.add_argument('in_file', help='conll file to check.')
+    parser.add_argument('out_file', help='failing sentences, each one after a ***** line.')
+    parser.add_argument('--single_root', action='store_true', help='sentences with more than one root fail too.')
+    parser.add_argument('--report', action='store_true',
+                        help='write the reason (e.g. the non-projective arcs) as a # line after *****.')
+    parser.add_argument('--batch', type=int, default=0, metavar='N',
+                        help='check N sentences at once with numpy, much faster on large corpora. '
+                             'about 2000 is fastest, the arrays of a batch stay in the cpu cache.')
+    args = parser.parse_args()
+    if args.batch > 0:
+        convert_batch(args.in_file, args.out_file, args.single_root, args.report, args.batch)
+    else:
+        convert(args.in_file, args.out_file, args.single_root, args.report)
@@ -4,20 +4,43 @@
 """
     句法分词适配器
     usage:
-        WSAdapter.py file.conll goldseg.conll outputfile.conll
+        WSAdapter.py file.conll goldseg.conll outputfile.conll [--jobs N] [--chunk_size M] [--checkout none|sync|background]
+                     [--cache_size N] [--cache_file F] [--checkpoint_every N] [--resume] [--profile_rules]
 """
-import sys
-from functools import reduce
-from collections import Counter
-from structure.word import SentenceAsTree, SentenceAsList, PlainWord, WordWithRel
+import os
+import time
+import pickle
+import argparse
+import multiprocessing
+from itertools import islice
+from functools import partial
+from collections import Counter, OrderedDict, deque
+from structure.word import SentenceAsArray, PlainWord, WordWithRel, SPLIT_CHAR
 from structure.data_iter import *
-import codecs
+from structure.conll_writer import ConllWriter
+from structure.checkpoint import Checkpoint, check_text_inputs
+from structure.fingerprint import fingerprint
 
+# index, word, head and rel, the other columns are copied as they are.
+USED_COLUMNS = (0, 1, 6, 7)
+# overlap shapes, number of source words : number of target words.
+SHAPES = ('1:1', '1:N', 'N:1', 'M:N')
 
-class Rule(object):
+
+def overlap_shape(source_list, tar_list):
+    """
+    :return: shape of an overlap in SHAPES
     """
+    if len(source_list) == 1:
+        return '1:1' if len(tar_list) == 1 else '1:N'
+    return 'N:1' if len(tar_list) == 1 else 'M:N'
 
+
+class Rule(object):
     """
+    a rule is only tried on the overlaps of its shapes, see Adapter.add_rule.
+    """
+    shapes = SHAPES
 
     def __init__(self):
         pass
@@ -38,11 +61,14 @@ class Rule(object):
         :param word_list: a list of WordWithRel
         :return: index of head word or -1 if the list is not in a subtree.
         """
-        parent_outside = [0 if w.parent in word_list else 1 for w in word_list]
-        if sum(parent_outside) == 1:
-            return parent_outside.index(1)
-        else:
-            return -1
+        ids = set([id(w) for w in word_list])
+        head = -1
+        for i, w in enumerate(word_list):
+            if id(w.parent) not in ids:
+                if not head == -1:
+                    return -1
+                head = i
+        return head
 
     @staticmethod
     def suture_word_wise(word1, word2):
@@ -68,126 +94,471 @@ class MergeRule(Rule):
     """
     AB C D => ABCD
     """
+    shapes = ('1:1', 'N:1')
 
     def adapt(self, source_olist, tar_olist):
-        if len(tar_olist) == 1 and not (self.find_head(source_olist) == -1):
-            core = source_olist[self.find_head(source_olist)]
-            new_word = WordWithRel.construct_with_args(0, tar_olist[0].word, core.parent, core.rel)
-            self.change_child(core.parent, core, new_word)
-            self.suture_word_wise(source_olist[0].pre, new_word)
-            self.suture_word_wise(new_word, source_olist[-1].next)
-            self.suture_parent(new_word, reduce(lambda x, y: x + y, [list(filter(lambda c:c not in source_olist, w.children)) for w in source_olist], []))
-            return True
-        return False
+        if not len(tar_olist) == 1:
+            return False
+        core_index = self.find_head(source_olist)
+        if core_index == -1:
+            return False
+        core = source_olist[core_index]
+        new_word = WordWithRel.construct_with_args(0, tar_olist[0].word, core.parent, core.rel)
+        self.change_child(core.parent, core, new_word)
+        self.suture_word_wise(source_olist[0].pre, new_word)
+        self.suture_word_wise(new_word, source_olist[-1].next)
+        # the children outside the merged words, in order
+        ids = set([id(w) for w in source_olist])
+        self.suture_parent(new_word, [c for w in source_olist for c in w.children if id(c) not in ids])
+        return True
 
 
 class SplitRule(Rule):
     """
     ABCD => AB C D
     """
+    shapes = ('1:1', '1:N')
 
     def adapt(self, source_olist, tar_olist):
-        if len(source_olist) == 1 and not (self.find_head(tar_olist) == -1):
-            core_index = self.find_head(tar_olist)
-            new_words = [WordWithRel.construct_with_args(0, w.word, None, w.rel) for w in tar_olist]
-            for i, w in enumerate(new_words):
-                if not i == 0:
-                    self.suture_word_wise(new_words[i - 1], w)
-                if i == core_index:
-                    self.change_child(source_olist[0].parent, source_olist[0], w)
-                    w.rel = source_olist[0].rel
-                    self.suture_parent(w, source_olist[0].children)
-                else:
-                    parent = new_words[tar_olist.index(tar_olist[i].parent)]
-                    w.parent = parent
-                    parent.children += [w]
+        if not len(source_olist) == 1:
+            return False
+        core_index = self.find_head(tar_olist)
+        if core_index == -1:
+            return False
+        new_words = [WordWithRel.construct_with_args(0, w.word, None, w.rel) for w in tar_olist]
+        position = dict([(id(w), i) for i, w in enumerate(tar_olist)])
+        for i, w in enumerate(new_words):
+            if not i == 0:
+                self.suture_word_wise(new_words[i - 1], w)
+            if i == core_index:
+                self.change_child(source_olist[0].parent, source_olist[0], w)
+                w.rel = source_olist[0].rel
+                self.suture_parent(w, source_olist[0].children)
+            else:
+                parent = new_words[position[id(tar_olist[i].parent)]]
+                w.parent = parent
+                parent.children += [w]
+
+        self.suture_word_wise(source_olist[0].pre, new_words[0])
+        self.suture_word_wise(new_words[-1], source_olist[0].next)
+        return True
+
+
+class AdaptCache(object):
+    """
+    LRU cache of adapted sentences, keyed on the fingerprint of the source and target trees.
+    a value is (tokens, counter delta) of one adapting. a token is (source row or -1 for a new word, index, word,
+    head, rel), so a duplicate sentence with other values in the untouched columns is rebuilt from its own rows.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.stats = Counter()
+        # entries put since the last take_added, None if not tracked.
+        self.added = None
+
+    @staticmethod
+    def key(source, target):
+        """
+        :param source: SentenceAsArray
+        :param target: SentenceAsArray
+        """
+        text = '\n'.join(['\t'.join(source.forms[1:]), '\t'.join(source.rels[1:]),
+                          '\t'.join(target.forms[1:]), '\t'.join(target.rels[1:])])
+        return fingerprint(b''.join([text.encode('utf8'), source.index.tobytes(), source.heads.tobytes(),
+                                     target.index.tobytes(), target.heads.tobytes()]))
 
-            self.suture_word_wise(source_olist[0].pre, new_words[0])
-            self.suture_word_wise(new_words[-1], source_olist[0].next)
-            return True
-        return False
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.stats.update(['cache_miss'])
+            return None
+        self.entries.move_to_end(key)
+        self.stats.update(['cache_hit'])
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if self.added is not None:
+            self.added.append((key, value))
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats.update(['cache_eviction'])
+
+    def take_added(self):
+        added, self.added = self.added, ([] if self.added is not None else None)
+        return added or []
+
+    def load(self, filename):
+        """
+        put the entries saved by save, a missing file is an empty cache.
+        """
+        try:
+            with open(filename, 'rb') as f:
+                entries = pickle.load(f)
+        except FileNotFoundError:
+            return
+        for key, value in entries[-self.size:]:
+            self.entries[key] = value
+
+    def save(self, filename):
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(list(self.entries.items()), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def conll_str(rows, tokens):
+        out = []
+        for row, index, word, head, rel in tokens:
+            line = ['_'] * 10 if row < 0 else list(rows[row])
+            line[0], line[1], line[6], line[7] = str(index), word, str(head), rel
+            out.append(SPLIT_CHAR.join(line) + '\n')
+        return ''.join(out)
 
 
 class Adapter(object):
-    def __init__(self, rules):
+    def __init__(self, rules, cache_size=0, profile=False):
+        """
+        :param cache_size: sentences kept in the AdaptCache, 0 for no cache
+        :param profile: count the calls, hits and seconds of each rule in rule_stats, see rule_profile
+        """
         self.rules = []
+        # shape => rules of the shape, in the order they were added
+        self.dispatch = dict([(shape, []) for shape in SHAPES])
         [self.add_rule(rule) for rule in rules]
         self.counter = Counter()
+        self.cache = AdaptCache(cache_size) if cache_size > 0 else None
+        self.rule_stats = Counter() if profile else None
 
     def add_rule(self, rule):
         if not isinstance(rule, Rule):
             raise ValueError('Input rule mast a instance of Rule.')
+        for shape in rule.shapes:
+            if shape not in self.dispatch:
+                raise ValueError('Unknown shape %s of %s, use %s.' % (shape, rule.__class__.__name__, ' '.join(SHAPES)))
         self.rules.append(rule)
+        for shape in rule.shapes:
+            self.dispatch[shape].append(rule)
 
     def set_sentence(self, source, target_split):
         self.source = source
         self.target = target_split
         if not self.check_same():
-            raise ValueError('Not Same sentence input. [' + self.source.plain() + '] and [' + self.target.plain() + ']')
+            source, target = self.source.plain(), self.target.plain()
+            offset = next((i for i, (a, b) in enumerate(zip(source, target)) if not a == b), min(len(source), len(target)))
+            raise ValueError('Not Same sentence input at character %d. [%s] and [%s]' % (offset, source, target))
 
     def check_same(self):
         return self.source.plain() == self.target.plain()
 
+    def adapt_array(self, source, target_split, source_str=None):
+        """
+        adapt a pair of SentenceAsArray, linked trees are only built when the segmentations differ.
+        :param source_str: conll string of source if the caller has it already, returned as it is when nothing changes
+        :return: conll string of the adapted source sentence
+        """
+        if source.forms == target_split.forms:
+            self.counter.update(['no_overlap'])
+            return source.conll_str() if source_str is None else source_str
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(source, target_split)
+            value = self.cache.get(key)
+            if value is not None:
+                tokens, delta = value
+                self.counter.update(dict(delta))
+                return self.cache.conll_str(source.rows, tokens)
+            before = Counter(self.counter)
+        self.set_sentence(source.to_tree(), target_split.to_tree())
+        self.adapt()
+        adapted = self.source.conll_str()
+        if key is not None:
+            rows = {id(row): i for i, row in enumerate(source.rows)}
+            tokens = tuple([(rows.get(id(w.line), -1), w.index, w.word, w.parent.index, w.rel)
+                            for w in self.source.iter_item() if w.parent is not None])
+            self.cache.put(key, (tokens, tuple((self.counter - before).items())))
+        return adapted
+
+    @staticmethod
+    def iter_overlaps(source_begin, tar_begin):
+        """
+        sweep the two word lists once, keeping the character offset of the end of the current word in each list.
+        an overlap starts where two aligned words differ and ends at the next offset both lists share.
+        :return: generator of (source_list, tar_list) in sentence order
+        """
+        s, t = source_begin, tar_begin
+        # character offset of the beginning of s and t
+        offset = 0
+        while s is not None and t is not None:
+            if not (isinstance(s, PlainWord) and isinstance(t, PlainWord)):
+                raise ValueError('Input begins mast a instance of PlainWord.')
+            if s.word == t.word:
+                offset += len(s.word)
+                s, t = s.next, t.next
+                continue
+            source_list, tar_list = [s], [t]
+            s_end, t_end = len(s.word), len(t.word)
+            while not s_end == t_end:
+                if s_end < t_end:
+                    s = s.next
+                    if s is None:
+                        raise Adapter.mismatch(source_begin, tar_begin, offset + s_end, 'source ends')
+                    source_list.append(s)
+                    s_end += len(s.word)
+                else:
+                    t = t.next
+                    if t is None:
+                        raise Adapter.mismatch(source_begin, tar_begin, offset + t_end, 'target ends')
+                    tar_list.append(t)
+                    t_end += len(t.word)
+            yield source_list, tar_list
+            offset += s_end
+            s, t = s.next, t.next
+        if not (s is None and t is None):
+            raise Adapter.mismatch(source_begin, tar_begin, offset, 'source ends' if s is None else 'target ends')
+
+    @staticmethod
+    def mismatch(source_begin, tar_begin, offset, reason):
+        """
+        :return: ValueError of two word lists whose characters differ, with both texts and the character offset
+        """
+        def text(begin):
+            words = []
+            while begin is not None:
+                words.append(begin.word)
+                begin = begin.next
+            return ' '.join(words)
+        return ValueError('%s at character %d, the segmentations do not cover the same text. source: [%s] target: [%s]'
+                          % (reason, offset, text(source_begin), text(tar_begin)))
+
+    def get_overlaps(self, source_begin, tar_begin):
+        """
+        :return: all overlap regions after the two begins, [(source_list, tar_list)]
+        """
+        return list(self.iter_overlaps(source_begin, tar_begin))
+
     def get_overlap(self, source_begin, tar_begin):
-        if source_begin is None and tar_begin is None:
-            # return None at the end of each sentence
-            return None, None
-        if not (isinstance(source_begin, PlainWord) and isinstance(tar_begin, PlainWord)):
-            raise ValueError('Input begins mast a instance of PlainWord.')
-        elif source_begin.word == tar_begin.word:
-            return self.get_overlap(source_begin.next, tar_begin.next)
-        else:
-            # overlap
-            source_list = [source_begin]
-            tar_list = [tar_begin]
-            while not ''.join([w.word for w in source_list]) == ''.join([w.word for w in tar_list]):
-                s_str = ''.join([w.word for w in source_list])
-                t_str = ''.join([w.word for w in tar_list])
-                short_list = tar_list if len(s_str) > len(t_str) else source_list
-                short_list.append(short_list[-1].next)
-            return source_list, tar_list
-
-    def adapt(self, source_begin=None, tar_begin=None, deep=0):
-        if deep == 0:
-            source_begin = self.source.root.next
-            tar_begin = self.target.root.next
-        source_list, tar_list = self.get_overlap(source_begin, tar_begin)
-        if source_list is None and tar_list is None:
-            if deep == 0:
-                # 第一次找而且没找到任何错误
-                self.counter.update(['no_overlap'])
-            elif source_begin == self.source.root.next and tar_begin == self.target.root.next:
-                # 从头开始找的，而且没有找到
-                self.counter.update(['managed'])
-            elif not source_begin == self.source.root.next:
-                # 不是从头开始找的，而且没找到，意味着之前有没能处理的overlap
-                self.counter.update(['unmanged'])
+        """
+        :return: the first overlap after the two begins, or (None, None) at the end of the sentence
+        """
+        return next(self.iter_overlaps(source_begin, tar_begin), (None, None))
+
+    def adapt(self):
+        """
+        apply the rules to every overlap from left to right, each overlap is patched at most once,
+        the search goes on after the patched span and the sentence is re-indexed once at the end.
+        """
+        overlaps = self.get_overlaps(self.source.root.next, self.target.root.next)
+        if len(overlaps) == 0:
+            # 没有找到任何错误
+            self.counter.update(['no_overlap'])
             return
-        else:
-            for i, r in enumerate(self.rules):
-                if r.adapt(source_list, tar_list):
-                    self.source.re_index()
+        managed = 0
+        for source_list, tar_list in overlaps:
+            for r in self.dispatch[overlap_shape(source_list, tar_list)]:
+                if self.__apply(r, source_list, tar_list):
                     self.counter.update([r.__class__.__name__])
-                    return self.adapt(self.source.root.next, self.target.root.next, deep + 1)
-            else:
-                return self.adapt(source_list[-1].next, tar_list[-1].next, deep + 1)
+                    managed += 1
+                    break
+        if managed:
+            self.source.re_index()
+        # 有没能处理的overlap则为unmanged
+        self.counter.update(['managed' if managed == len(overlaps) else 'unmanged'])
+
+    def __apply(self, rule, source_list, tar_list):
+        if self.rule_stats is None:
+            return rule.adapt(source_list, tar_list)
+        name = rule.__class__.__name__
+        start = time.perf_counter()
+        hit = rule.adapt(source_list, tar_list)
+        self.rule_stats[name + ' seconds'] += time.perf_counter() - start
+        self.rule_stats.update([name + ' calls'] + ([name + ' hits'] if hit else []))
+        return hit
+
+
+def rule_profile(rule_stats):
+    """
+    :param rule_stats: Adapter.rule_stats, or the sum of several
+    :return: lines of rule, calls, hits and seconds, the slowest rule first
+    """
+    names = sorted(set([key.rpartition(' ')[0] for key in rule_stats]),
+                   key=lambda name: -rule_stats[name + ' seconds'])
+    return ['%s\tcalls: %d\thits: %d\tseconds: %.3f' % (name, rule_stats[name + ' calls'], rule_stats[name + ' hits'],
+                                                        rule_stats[name + ' seconds']) for name in names]
+
+
+def pair_batches(source, tar, chunk_size, marks=None):
+    """
+    group (source, target) sentence lines into lists of chunk_size pairs, stop at the end of the shorter file.
+    :param marks: the inputs are read with_offsets, the batches are yielded without them and
+        (batch length, source offset, target offset) after each batch is appended to marks, e.g. a deque
+    """
+    pairs = zip(source, tar)
+    while True:
+        batch = list(islice(pairs, chunk_size))
+        if not batch:
+            return
+        if marks is not None:
+            (_, source_end), (_, tar_end) = batch[-1]
+            marks.append((len(batch), source_end, tar_end))
+            batch = [(s, t) for (s, _), (t, _) in batch]
+        yield batch
+
+
+# Adapter of this process, kept between the batches so its cache is too.
+_adapter = None
+
+
+def init_adapter(cache_size=0, cache_file=None, track=False, profile=False):
+    """
+    set up the Adapter of this process, can be the initializer of a worker pool.
+    :param cache_file: cache entries to start with, see AdaptCache.load
+    :param track: return the new cache entries with each batch, for the process that saves the cache
+    :param profile: time the rules, see Adapter
+    """
+    global _adapter
+    _adapter = Adapter([MergeRule(), SplitRule()], cache_size, profile)
+    if _adapter.cache is not None:
+        if cache_file is not None:
+            _adapter.cache.load(cache_file)
+        if track:
+            _adapter.cache.added = []
+    return _adapter
+
+
+def adapt_batch(batch, checkout=True, adapter=None):
+    """
+    adapt a batch of sentence pairs with the Adapter of this process, can be run in a worker process.
+    :param checkout: keep the conll string before adapting, None is kept otherwise
+    :param adapter: Adapter to use instead of the one of this process
+    :return: [(conll before adapting, conll after adapting)], counter, cache stats, new cache entries
+        and rule stats (empty if not profiled) of this batch
+    """
+    adp = adapter or _adapter or init_adapter()
+    results = []
+    for s, t in batch:
+        s, t = SentenceAsArray(s), SentenceAsArray(t)
+        before = s.conll_str() if checkout else None
+        results.append((before, adp.adapt_array(s, t, before)))
+    counter, adp.counter = adp.counter, Counter()
+    rule_stats = Counter()
+    if adp.rule_stats is not None:
+        rule_stats, adp.rule_stats = adp.rule_stats, Counter()
+    if adp.cache is None:
+        return results, counter, Counter(), [], rule_stats
+    stats, adp.cache.stats = adp.cache.stats, Counter()
+    return results, counter, stats, adp.cache.take_added(), rule_stats
 
 
 if __name__ == '__main__':
-    source = conll_sentence_iter(sys.argv[1])
-    tar = conll_sentence_iter(sys.argv[2])
+    parser = argparse.ArgumentParser(description='句法分词适配器')
+    parser.add_argument('source_file', help='conll file to be adapted.')
+    parser.add_argument('tar_file', help='conll file with the gold segmentation.')
+    parser.add_argument('output_file', help='output path, output_file.checkout is written too.')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes.')
+    parser.add_argument('--chunk_size', type=int, default=500, help='sentence pairs sent to a worker at once.')
+    parser.add_argument('--checkout', choices=['none', 'sync', 'background'], default='sync',
+                        help='output_file.checkout with each sentence before and after adapting: '
+                             'not written, written by this thread or by a background thread.')
+    parser.add_argument('--prefetch', action='store_true', help='read the inputs ahead in background threads.')
+    parser.add_argument('--cache_size', type=int, default=0,
+                        help='adapted sentences kept for duplicate pairs in each process, 0 for no cache.')
+    parser.add_argument('--cache_file', default=None, help='load the cache of --cache_size N from this file and save it back at the end.')
+    parser.add_argument('--checkpoint_every', type=int, default=0, metavar='N',
+                        help='save a checkpoint in output_file.ckpt after about every N sentences, 0 for none.')
+    parser.add_argument('--resume', action='store_true',
+                        help='go on from output_file.ckpt, the outputs are cut back to it.')
+    parser.add_argument('--profile_rules', action='store_true',
+                        help='print the calls, hits and seconds of each rule, sentences from the cache are not counted.')
+    args = parser.parse_args()
+    if args.checkpoint_every > 0 or args.resume:
+        check_text_inputs([args.source_file, args.tar_file])
+    ckpt = Checkpoint(args.output_file + Checkpoint.SUFFIX, [args.source_file, args.tar_file])
+    state = ckpt.load() if args.resume else None
+    if args.resume and state is None:
+        print('no checkpoint %s, starting from the beginning.' % ckpt.filename)
+    if state is not None and not args.checkout == 'none' and 'checkout' not in state['output_offsets']:
+        raise ValueError('%s was saved without checkout file, resume with --checkout none.' % ckpt.filename)
+    # offsets are tracked if a checkpoint will be saved.
+    tracking = args.checkpoint_every > 0 or state is not None
+    offsets = state['input_offsets'] if state else [0, 0]
+    source = conll_sentence_iter(args.source_file, USED_COLUMNS, prefetch=args.prefetch,
+                                 offset=offsets[0], with_offsets=tracking)
+    tar = conll_sentence_iter(args.tar_file, USED_COLUMNS, prefetch=args.prefetch,
+                              offset=offsets[1], with_offsets=tracking)
     adp = Adapter([MergeRule(), SplitRule()])
+    cache_stats = Counter()
+    rule_stats = Counter()
+    sentences = 0
+    if state is not None:
+        adp.counter, cache_stats, sentences = state['counters']['adapter'], state['counters']['cache'], state['sentences']
+        rule_stats = state['counters'].get('rules', Counter())
+    marks = deque() if tracking else None
+    batches = pair_batches(source, tar, args.chunk_size, marks)
+    work = partial(adapt_batch, checkout=not args.checkout == 'none')
+    cache_args = (args.cache_size, args.cache_file, args.cache_file is not None, args.profile_rules)
+    pool = multiprocessing.Pool(args.jobs, init_adapter, cache_args) if args.jobs > 1 else None
+    # the cache that is saved: the one of this process, or one collecting the new entries of the workers.
+    if pool is None:
+        cache = init_adapter(args.cache_size, args.cache_file, profile=args.profile_rules).cache
+    else:
+        cache = AdaptCache(args.cache_size) if args.cache_file is not None and args.cache_size > 0 else None
+        if cache is not None:
+            cache.load(args.cache_file)
+    output_offsets = state['output_offsets'] if state else {}
+    fck = None
     try:
-        with codecs.open(sys.argv[3], 'w', encoding='utf8') as fo:
-            with codecs.open(sys.argv[3] + '.checkout', 'w', encoding='utf8') as fck:
-                while True:
-                    s, t = SentenceAsTree(next(source)), SentenceAsTree(next(tar))
-                    fck.write(s.conll_str() + '\n')
-                    adp.set_sentence(s, t)
-                    adp.adapt()
-                    # print(s.conll_str())
-                    fo.write(s.conll_str() + '\n')
-                    fck.write(s.conll_str() + '\n')
-    except StopIteration:
-        print(adp.counter)
-        exit(0)
+        with ConllWriter(args.output_file, offset=output_offsets.get('output')) as fo:
+            if not args.checkout == 'none':
+                fck = ConllWriter(args.output_file + '.checkout', background=args.checkout == 'background',
+                                  offset=output_offsets.get('checkout'))
+
+            def save_checkpoint():
+                # the outputs are on disk before the checkpoint points after them.
+                fo.flush(sync=True)
+                output_offsets['output'] = fo.tell()
+                if fck is not None:
+                    fck.flush(sync=True)
+                    output_offsets['checkout'] = fck.tell()
+                ckpt.save(offsets, output_offsets, sentences,
+                          {'adapter': adp.counter, 'cache': cache_stats, 'rules': rule_stats})
+
+            unsaved = 0
+            # imap keeps the input order of the batches.
+            for results, counter, stats, added, rules in (pool.imap(work, batches) if pool else map(work, batches)):
+                adp.counter.update(counter)
+                cache_stats.update(stats)
+                rule_stats.update(rules)
+                for key, value in added:
+                    cache.put(key, value)
+                for before, adapted in results:
+                    if fck is not None:
+                        fck.write(before + '\n')
+                        fck.write(adapted + '\n')
+                    # print(adapted)
+                    fo.write(adapted + '\n')
+                if marks is not None:
+                    n, offsets[0], offsets[1] = marks.popleft()
+                    sentences += n
+                    unsaved += n
+                    if args.checkpoint_every > 0 and unsaved >= args.checkpoint_every:
+                        save_checkpoint()
+                        unsaved = 0
+            if tracking:
+                save_checkpoint()
+    finally:
+        if fck is not None:
+            fck.close()
+        if pool:
+            pool.close()
+            pool.join()
+    if args.cache_file is not None and cache is not None:
+        cache.save(args.cache_file)
+    print(adp.counter)
+    if args.cache_size > 0:
+        print(cache_stats)
+    if args.profile_rules:
+        print('\n'.join(rule_profile(rule_stats)))
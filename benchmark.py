@@ -0,0 +1,342 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Benchmark of the scripts on a synthetic corpus.
+    usage:
+        ./benchmark.py [--sentences N] [--only conll_sentence_iter,merge_pos] [--output bench.json]
+
+    The corpus is generated in --data_dir (a temporary directory by default):
+        corpus.conll        source treebank
+        corpus.tar.conll    same text with another segmentation, for WSAdapter
+        corpus.pos.txt      word_POS of the source words, for mergepos
+        corpus.mg.conll     source treebank with mg_ws_err functional tags
+        corpus.filter.conll every other source sentence, for set_operate filter
+    Each benchmark runs in its own process, the result is written as json:
+        {"config": {...}, "results": {"merge_pos": {"seconds", "sentences", "sentences_per_s", "mb_per_s",
+                                                    "peak_rss_mb"}, ...}}
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+
+from structure.memory import peak_rss_mb
+from structure.tree_check import check_acyclic, non_projective_arcs
+
+CHARS = '的一是不了人我在有他这中大来上国个到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后小么心多天而能好都然' \
+        '没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长'
+POS = ['n', 'v', 'a', 'd', 'p', 'u', 'wp', 'nh', 'ns']
+RELS = ['SBV', 'VOB', 'ATT', 'ADV', 'COO', 'HED', 'WP', 'RAD', 'POB', 'CMP']
+FUNC_LIST = ['MR', 'ML', 'M1R', 'M1L', 'M2R', 'M2L']
+
+
+class CorpusGenerator(object):
+    """
+    random projective trees, with a part of them made non-projective and a part of them segmented differently.
+    """
+
+    def __init__(self, seed=0, min_len=1, max_len=60, length_dist='normal', length_mean=20, length_std=10,
+                 nonprojective_rate=0.05, disagreement_rate=0.3):
+        self.random = random.Random(seed)
+        self.min_len, self.max_len = min_len, max_len
+        self.length_dist, self.length_mean, self.length_std = length_dist, length_mean, length_std
+        self.nonprojective_rate = nonprojective_rate
+        self.disagreement_rate = disagreement_rate
+
+    def length(self):
+        if self.length_dist == 'uniform':
+            return self.random.randint(self.min_len, self.max_len)
+        n = int(round(self.random.gauss(self.length_mean, self.length_std)))
+        return min(max(n, self.min_len), self.max_len)
+
+    def form(self):
+        return ''.join([self.random.choice(CHARS) for _ in range(self.random.choice([1, 1, 2, 2, 2, 3]))])
+
+    def projective_heads(self, n):
+        heads = [-1] + [0] * n
+        todo = [(1, n + 1, 0)]
+        while todo:
+            lo, hi, head = todo.pop()
+            if lo >= hi:
+                continue
+            r = self.random.randrange(lo, hi)
+            heads[r] = head
+            todo.append((lo, r, r))
+            todo.append((r + 1, hi, r))
+        return heads
+
+    def make_nonprojective(self, heads):
+        n = len(heads) - 1
+        for _ in range(20):
+            d, h = self.random.randint(1, n), self.random.randint(1, n)
+            old = heads[d]
+            heads[d] = h
+            if not d == h and check_acyclic(heads) and non_projective_arcs(heads):
+                return heads
+            heads[d] = old
+        return heads
+
+    def sentence(self):
+        n = self.length()
+        heads = self.projective_heads(n)
+        if n > 2 and self.random.random() < self.nonprojective_rate:
+            heads = self.make_nonprojective(heads)
+        return [(self.form(), heads[i], self.random.choice(RELS)) for i in range(1, n + 1)]
+
+    def resegment(self, words):
+        """
+        merge a leaf with its neighbouring head or split a word into characters, the changed part stays a subtree.
+        :return: [(form, head, rel)] of the other segmentation
+        """
+        words = [list(w) for w in words]
+        n = len(words)
+        children = [0] * (n + 1)
+        for w in words:
+            children[w[1]] += 1
+        k = self.random.randint(1, n)
+        if len(words[k - 1][0]) > 1 and self.random.random() < 0.5:
+            # split k into characters, the first one keeps head and children of k.
+            chars = words[k - 1][0]
+            m = len(chars) - 1
+            remap = lambda p: p + m if p > k else p
+            new = [[f, remap(h), r] for f, h, r in words[:k - 1]]
+            new.append([chars[0], remap(words[k - 1][1]), words[k - 1][2]])
+            new += [[c, k, 'RAD'] for c in chars[1:]]
+            new += [[f, remap(h), r] for f, h, r in words[k:]]
+            return new
+        for leaf, head in [(k, k + 1), (k, k - 1)]:
+            if 1 <= head <= n and words[leaf - 1][1] == head and children[leaf] == 0:
+                first, second = min(leaf, head), max(leaf, head)
+                remap = lambda p: p - 1 if p >= second else p
+                merged = [words[first - 1][0] + words[second - 1][0], remap(words[head - 1][1]), words[head - 1][2]]
+                new = [[f, remap(h), r] for f, h, r in words[:first - 1]]
+                new.append(merged)
+                new += [[f, remap(h), r] for f, h, r in words[second:]]
+                return new
+        return words
+
+    @staticmethod
+    def conll_lines(words, pos=None, func=None):
+        return ''.join(['%d\t%s\t_\t%s\t%s\t_\t%d\t%s\t_\t_\n' % (
+            i, f, '_' if func is None else func[i - 1], '_' if pos is None else pos[i - 1], h, r)
+                        for i, (f, h, r) in enumerate(words, 1)])
+
+    def func_tags(self, words):
+        """
+        functional tags which mg_ws_err can apply (no overlapping tags, no merged word with children).
+        """
+        n = len(words)
+        has_children = [False] * (n + 1)
+        for f, h, r in words:
+            has_children[h] = True
+        tags = ['_'] * n
+        used = set()
+        for i in range(n):
+            if i in used or self.random.random() < 0.8:
+                continue
+            op = self.random.choice(FUNC_LIST)
+            j = i + 1 if op.endswith('R') else i - 1
+            if j < 0 or j >= n or j in used:
+                continue
+            if op in ['MR', 'ML']:
+                ok = not has_children[j + 1]
+            else:
+                ok = len(words[j][0]) > int(op[1])
+            if ok:
+                tags[i] = op
+                used.update([i, j])
+        return tags
+
+    def write(self, prefix, sentences):
+        """
+        :return: dict of generated file names
+        """
+        files = {
+            'source': prefix + '.conll',
+            'target': prefix + '.tar.conll',
+            'pos': prefix + '.pos.txt',
+            'mg': prefix + '.mg.conll',
+            'filter': prefix + '.filter.conll',
+        }
+        with contextlib.ExitStack() as stack:
+            fos = {k: stack.enter_context(open(f, 'w', encoding='utf8')) for k, f in files.items()}
+            for i in range(sentences):
+                words = self.sentence()
+                pos = [self.random.choice(POS) for _ in words]
+                target = self.resegment(words) if self.random.random() < self.disagreement_rate else words
+                source = self.conll_lines(words, pos)
+                fos['source'].write(source + '\n')
+                fos['target'].write(self.conll_lines(target) + '\n')
+                fos['pos'].write('\t'.join([w[0] + '_' + p for w, p in zip(words, pos)]) + '\n')
+                fos['mg'].write(self.conll_lines(words, pos, self.func_tags(words)) + '\n')
+                if i % 2 == 0:
+                    fos['filter'].write(source + '\n')
+        return files
+
+
+def bench_conll_sentence_iter(files, out_dir):
+    from structure.data_iter import conll_sentence_iter
+    n = 0
+    start = time.perf_counter()
+    for _ in conll_sentence_iter(files['source']):
+        n += 1
+    return time.perf_counter() - start, n, files['source']
+
+
+def bench_sentence_as_tree(files, out_dir):
+    from structure.data_iter import conll_sentence_iter
+    from structure.word import SentenceAsTree
+    stns = list(conll_sentence_iter(files['source']))
+    start = time.perf_counter()
+    for stn in stns:
+        SentenceAsTree(stn)
+    return time.perf_counter() - start, len(stns), files['source']
+
+
+def bench_adapter(files, out_dir):
+    from structure.data_iter import conll_sentence_iter
+    from structure.word import SentenceAsTree
+    from WSAdapter import Adapter, MergeRule, SplitRule
+    pairs = [(SentenceAsTree(s), SentenceAsTree(t))
+             for s, t in zip(conll_sentence_iter(files['source']), conll_sentence_iter(files['target']))]
+    adp = Adapter([MergeRule(), SplitRule()])
+    start = time.perf_counter()
+    for s, t in pairs:
+        adp.set_sentence(s, t)
+        adp.adapt()
+    return time.perf_counter() - start, len(pairs), files['source']
+
+
+def bench_merge_pos(files, out_dir):
+    from structure.data_iter import conll_sentence_iter, ws_sentence_iter
+    from mergepos import USED_COLUMNS, merge_rows
+    pairs = list(zip(conll_sentence_iter(files['source'], USED_COLUMNS), ws_sentence_iter(files['pos'])))
+    start = time.perf_counter()
+    for rows, tokens in pairs:
+        merge_rows(rows, tokens)
+    return time.perf_counter() - start, len(pairs), files['source']
+
+
+def bench_filter(files, out_dir):
+    from set_operate import Filter
+    argv = argparse.Namespace(input_file=files['source'], filter_file=files['filter'],
+                              output_file=os.path.join(out_dir, 'filter.conll'),
+                              remain_file=os.path.join(out_dir, 'filter.remain.conll'),
+                              not_fit_filters=None, force=False, streaming=False)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        Filter.process(argv)
+    return time.perf_counter() - start, count_sentences(files['source']), files['source']
+
+
+def bench_projective_check(files, out_dir):
+    import ProjectiveCheck
+    start = time.perf_counter()
+    ProjectiveCheck.convert(files['source'], os.path.join(out_dir, 'projective.txt'))
+    return time.perf_counter() - start, count_sentences(files['source']), files['source']
+
+
+def bench_mg_ws_err(files, out_dir):
+    import mg_ws_err
+    start = time.perf_counter()
+    mg_ws_err.convert(files['mg'], os.path.join(out_dir, 'mg.conll'))
+    return time.perf_counter() - start, count_sentences(files['mg']), files['mg']
+
+
+def bench_random_split(files, out_dir):
+    import random_split
+    corpus = os.path.join(out_dir, 'split.conll')
+    shutil.copy(files['source'], corpus)
+    n = count_sentences(corpus)
+    start = time.perf_counter()
+    random_split.split(corpus, n // 10, n - n // 10)
+    return time.perf_counter() - start, n, corpus
+
+
+BENCHMARKS = [
+    ('conll_sentence_iter', bench_conll_sentence_iter),
+    ('SentenceAsTree', bench_sentence_as_tree),
+    ('Adapter.adapt', bench_adapter),
+    ('merge_pos', bench_merge_pos),
+    ('Filter.process', bench_filter),
+    ('ProjectiveCheck.convert', bench_projective_check),
+    ('mg_ws_err.convert', bench_mg_ws_err),
+    ('random_split.split', bench_random_split),
+]
+
+
+def count_sentences(filename):
+    with open(filename, 'rb') as fi:
+        return fi.read().count(b'\n\n')
+
+
+def run_in_process(func, files, out_dir):
+    seconds, sentences, filename = func(files, out_dir)
+    return {
+        'seconds': seconds,
+        'sentences': sentences,
+        'sentences_per_s': sentences / seconds if seconds else None,
+        'mb_per_s': os.path.getsize(filename) / 1024.0 / 1024.0 / seconds if seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run(files, out_dir, names=None):
+    """
+    run each benchmark in a new process, so that peak rss and caches do not leak between them.
+    """
+    results = {}
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        with multiprocessing.Pool(1) as pool:
+            try:
+                results[name] = pool.apply(run_in_process, (func, files, out_dir))
+            except Exception as e:
+                results[name] = {'error': '%s: %s' % (e.__class__.__name__, e)}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the scripts on a synthetic corpus.')
+    parser.add_argument('--sentences', type=int, default=20000, help='number of generated sentences.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--length_dist', choices=['normal', 'uniform'], default='normal',
+                        help='sentence length distribution, clipped to [min_len, max_len].')
+    parser.add_argument('--length_mean', type=float, default=20)
+    parser.add_argument('--length_std', type=float, default=10)
+    parser.add_argument('--min_len', type=int, default=1)
+    parser.add_argument('--max_len', type=int, default=60)
+    parser.add_argument('--nonprojective_rate', type=float, default=0.05,
+                        help='part of the sentences made non-projective.')
+    parser.add_argument('--disagreement_rate', type=float, default=0.3,
+                        help='part of the sentences segmented differently in the target file.')
+    parser.add_argument('--only', default=None, help='comma separated benchmark names: ' +
+                                                     ', '.join([name for name, _ in BENCHMARKS]))
+    parser.add_argument('--data_dir', default=None, help='keep the corpus and outputs in this directory.')
+    parser.add_argument('--output', default=None, help='json output path, stdout by default.')
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k not in ['only', 'data_dir', 'output']}
+    data_dir = args.data_dir if args.data_dir is not None else tempfile.mkdtemp(prefix='conll_bench_')
+    os.makedirs(data_dir, exist_ok=True)
+    try:
+        generator = CorpusGenerator(args.seed, args.min_len, args.max_len, args.length_dist, args.length_mean,
+                                    args.length_std, args.nonprojective_rate, args.disagreement_rate)
+        files = generator.write(os.path.join(data_dir, 'corpus'), args.sentences)
+        results = run(files, data_dir, args.only.split(',') if args.only else None)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir)
+    report = json.dumps({'config': config, 'results': results}, indent=2, sort_keys=True)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as fo:
+            fo.write(report + '\n')
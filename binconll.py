@@ -0,0 +1,33 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Convert between conll text and the binary corpus format of structure.binary.
+    usage:
+        ./binconll.py tobin <conll_file> <binary_file>
+        ./binconll.py toconll <binary_file> <conll_file>
+    the binary file can be given to WSAdapter.py, mergepos.py, set_operate.py and ProjectiveCheck.py directly.
+"""
+import sys
+import codecs
+
+from structure.data_iter import conll_sentence_iter
+from structure.binary import write_binary, binary_sentence_iter
+from structure.word import SentenceAsTree
+
+
+def to_binary(in_file, out_file):
+    return write_binary(conll_sentence_iter(in_file), out_file)
+
+
+def to_conll(in_file, out_file):
+    with codecs.open(out_file, 'w', encoding='utf8') as fo:
+        for stn in binary_sentence_iter(in_file):
+            fo.write(SentenceAsTree(stn).conll_str() + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] not in ['tobin', 'toconll']:
+        print(__doc__)
+        exit(1)
+    (to_binary if sys.argv[1] == 'tobin' else to_conll)(sys.argv[2], sys.argv[3])
@@ -2,46 +2,170 @@
 # -*- coding: utf-8 -*_
 # Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
 
-import sys
-import codecs
-from WSAdapter import conll_sentence_iter, ws_sentence_iter, SentenceAsTree, SentenceAsList
+import argparse
+import multiprocessing
+from functools import partial
+from collections import Counter, deque
+from structure.checkpoint import Checkpoint, check_text_inputs
+from structure.data_iter import conll_sentence_iter, ws_sentence_iter
+from structure.conll_writer import ConllWriter
+from WSAdapter import pair_batches
 
 doc = """
     usage:
-        ./mergepos.py <conll_file> <pos_file> <output_conll_file>
-        
-        conll_file:
-        pos_file:
-        output_conll_file:
+        ./mergepos.py <conll_file> <pos_file> <output_conll_file> [--reject_file F] [--on_reject keep|drop] [--jobs N]
+                    [--checkpoint_every N] [--resume]
+
+        conll_file: conll sentences
+        pos_file: one sentence per line, word_POS tokens separated by tabs
+        output_conll_file: conll_file with the POS of pos_file in column 4 and '_' in column 5
+
+    a sentence whose words do not match its pos line is written to the reject file with the reason,
+    and to the output as it is (keep) or not at all (drop).
 """
 
-def merge_pos(source, tar):
-    s = source.iter_item()
-    t = tar.iter_item()
-    next(s)
-    try:
-        while True:
-            sw, tw = next(s), next(t)
-            if not sw.word == tw.word[:tw.word.rfind('_')]:
-                raise ValueError()
-            sw.line[3] = tw.word[tw.word.rfind('_') + 1:]
-            sw.line[4] = '_'
-    except StopIteration:
-        return
+# index, word, cpos and pos, the other columns are copied as they are.
+USED_COLUMNS = (0, 1, 3, 4)
+WORD_INDEX = 1
+CPOS_INDEX = 3
+POS_INDEX = 4
+
+
+def split_tag(token):
+    """
+    'word_POS' => ('word', 'POS'), the word may contain '_' itself.
+    :return: (word, tag), tag is None if there is no '_'
+    """
+    word, sep, tag = token.rpartition('_')
+    return (word, tag) if sep else (token, None)
+
+
+def merge_rows(rows, tokens):
+    """
+    write the tags of tokens into the rows of one sentence, nothing is changed if they do not match.
+    :param rows: split conll lines
+    :param tokens: word_POS tokens of the sentence
+    :return: None if merged, the reason of the mismatch otherwise
+    """
+    if not len(rows) == len(tokens):
+        return 'length'
+    tags = []
+    for row, token in zip(rows, tokens):
+        word, tag = split_tag(token)
+        if tag is None:
+            return 'no_tag'
+        if len(row) <= POS_INDEX:
+            return 'columns'
+        if not row[WORD_INDEX] == word:
+            return 'word'
+        tags.append(tag)
+    for row, tag in zip(rows, tags):
+        row[CPOS_INDEX] = tag
+        row[POS_INDEX] = '_'
+    return None
+
+
+def conll_text(rows):
+    return ''.join(['\t'.join(row) + '\n' for row in rows])
+
+
+def merge_batch(numbered_batch, keep_rejected=True):
+    """
+    merge a batch of (rows, tokens) pairs, can be run in a worker process.
+    :param numbered_batch: (number of the first sentence, [(rows, tokens)])
+    :return: output text, reject text, counter of this batch
+    """
+    first, batch = numbered_batch
+    out, reject = [], []
+    counter = Counter()
+    for n, (rows, tokens) in enumerate(batch, first):
+        counter.update(['sentence'])
+        reason = merge_rows(rows, tokens)
+        if reason is None:
+            counter.update(['merged_sentence'])
+            out.append(conll_text(rows) + '\n')
+            continue
+        counter.update(['rejected_sentence', 'reject_' + reason])
+        reject.append('# sentence %d: %s\n' % (n, reason) + conll_text(rows) + '# pos: ' + '\t'.join(tokens) + '\n\n')
+        if keep_rejected:
+            out.append(conll_text(rows) + '\n')
+    return ''.join(out), ''.join(reject), counter
+
+
+def numbered_batches(source, tar, chunk_size, first=0, marks=None):
+    """
+    (number of the first sentence, list of chunk_size (rows, tokens) pairs), stop at the end of the shorter file.
+    :param marks: see WSAdapter.pair_batches
+    """
+    for batch in pair_batches(source, tar, chunk_size, marks):
+        yield first, batch
+        first += len(batch)
+
 
 if __name__ == '__main__':
-    source = conll_sentence_iter(sys.argv[1])
-    tar = ws_sentence_iter(sys.argv[2])
+    parser = argparse.ArgumentParser(description=doc, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('conll_file')
+    parser.add_argument('pos_file')
+    parser.add_argument('output_file')
+    parser.add_argument('--reject_file', default=None, help='default: output_file.reject')
+    parser.add_argument('--on_reject', choices=['keep', 'drop'], default='keep',
+                        help='write a rejected sentence to the output unchanged or leave it out.')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes.')
+    parser.add_argument('--chunk_size', type=int, default=1000, help='sentences sent to a worker at once.')
+    parser.add_argument('--prefetch', action='store_true', help='read the inputs ahead in background threads.')
+    parser.add_argument('--checkpoint_every', type=int, default=0, metavar='N',
+                        help='save a checkpoint in output_file.ckpt after about every N sentences, 0 for none.')
+    parser.add_argument('--resume', action='store_true',
+                        help='go on from output_file.ckpt, the outputs are cut back to it.')
+    args = parser.parse_args()
+    if args.checkpoint_every > 0 or args.resume:
+        check_text_inputs([args.conll_file])
+    reject_file = args.output_file + '.reject' if args.reject_file is None else args.reject_file
+    ckpt = Checkpoint(args.output_file + Checkpoint.SUFFIX, [args.conll_file, args.pos_file])
+    state = ckpt.load() if args.resume else None
+    if args.resume and state is None:
+        print('no checkpoint %s, starting from the beginning.' % ckpt.filename)
+    # offsets are tracked if a checkpoint will be saved.
+    tracking = args.checkpoint_every > 0 or state is not None
+    offsets = state['input_offsets'] if state else [0, 0]
+    source = conll_sentence_iter(args.conll_file, USED_COLUMNS, prefetch=args.prefetch,
+                                 offset=offsets[0], with_offsets=tracking)
+    tar = ws_sentence_iter(args.pos_file, prefetch=args.prefetch, offset=offsets[1], with_offsets=tracking)
+    counter = state['counters']['mergepos'] if state else Counter()
+    sentences = state['sentences'] if state else 0
+    marks = deque() if tracking else None
+    batches = numbered_batches(source, tar, args.chunk_size, sentences, marks)
+    work = partial(merge_batch, keep_rejected=args.on_reject == 'keep')
+    output_offsets = state['output_offsets'] if state else {}
+    pool = multiprocessing.Pool(args.jobs) if args.jobs > 1 else None
     try:
-        with codecs.open(sys.argv[3], 'w', encoding='utf8') as fo:
-            while True:
-                s1, t1 = next(source), next(tar)
-                try:
-                    s, t = SentenceAsTree(s1), SentenceAsList(t1)
-                except:
-                    print(s1, t1)
-                merge_pos(s, t)
-                # print(s.conll_str())
-                fo.write(s.conll_str() + '\n')
-    except StopIteration:
-        exit(0)
+        with ConllWriter(args.output_file, offset=output_offsets.get('output')) as fo, \
+                ConllWriter(reject_file, offset=output_offsets.get('reject')) as freject:
+
+            def save_checkpoint():
+                # the outputs are on disk before the checkpoint points after them.
+                fo.flush(sync=True)
+                freject.flush(sync=True)
+                output_offsets.update({'output': fo.tell(), 'reject': freject.tell()})
+                ckpt.save(offsets, output_offsets, sentences, {'mergepos': counter})
+
+            unsaved = 0
+            # imap keeps the input order of the batches.
+            for out, reject, batch_counter in (pool.imap(work, batches) if pool else map(work, batches)):
+                counter.update(batch_counter)
+                fo.write(out)
+                freject.write(reject)
+                if marks is not None:
+                    n, offsets[0], offsets[1] = marks.popleft()
+                    sentences += n
+                    unsaved += n
+                    if args.checkpoint_every > 0 and unsaved >= args.checkpoint_every:
+                        save_checkpoint()
+                        unsaved = 0
+            if tracking:
+                save_checkpoint()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    print(counter)
@@ -45,41 +45,27 @@ import os
 import sys
 import codecs
 
-SPLIT_CHAR = '\t'
-FUNC_LIST = ['MR', 'ML', 'M1R', 'M1L', 'M2R', 'M2L']
-
-class Word(object):
-    __idx_index = 0
-    __word_index = 1
-    __func_index = 3
-    __parent_index = 6
-
-    def __init__(self, line):
-        self.line = line
-        self.index = int(line[self.__idx_index]) if self.__idx_index < len(line) else None
-        self.word = line[self.__word_index] if self.__word_index < len(line) else None
-        self.parent = int(line[self.__parent_index]) if self.__parent_index < len(line) else None
-        self.func = line[self.__func_index] if self.__func_index < len(line) else None
-        self.next = None
-        self.pre = None
-        self.children = []
+from structure.core import Token, TokenSentence, FUNC_LIST
+
+class Word(Token):
+    __slots__ = ()
 
     def MR(self):
         assert not self.next is None
-        assert len(self.next.children) == 0
+        assert not self.next.has_children()
         self.func = '_'
         self.word += self.next.word
-        if self.next in self.children:
-            self.children.remove(self.next)
+        if self._children and self.next in self._children:
+            self._children.remove(self.next)
         self.next = self.next.next
 
     def ML(self):
         assert not self.pre is None
-        assert len(self.pre.children) == 0
+        assert not self.pre.has_children()
         self.func = '_'
         self.word = self.pre.word + self.word
-        if self.pre in self.children:
-            self.children.remove(self.pre)
+        if self._children and self.pre in self._children:
+            self._children.remove(self.pre)
         self.pre = self.pre.pre
 
     def MxR(self, x):
@@ -109,58 +95,30 @@ class Word(object):
         self.MxL(2)
 
     def __str__(self):
-        if self.parent is None: # skip root
-            return ''
-        self.line[self.__idx_index] = str(self.index)
-        self.line[self.__word_index] = self.word
-        self.line[self.__parent_index] = str(self.parent.index)
-        self.line[self.__func_index] = '_'
-        return SPLIT_CHAR.join(self.line) + '\n'
-
-class Sentence(object):
-
-    def __init__(self):
-        self.root = Word(['0', '<ROOT>'])
-
-    def init(self, stn):
-        words = [self.root]
-        for i in stn:
-            words.append(Word(i))
-        # manage parents
-        for i in words:
-            i.parent = words[i.parent] if i.parent is not None else None
-        # manage pre next children
-        for i in words:
-            i.next = words[i.index + 1] if i.index + 1 < len(words) else None
-            i.pre = words[i.index - 1] if i.index - 1 >= 0 else None
-            if not i.parent is None:
-                i.parent.children.append(i)
+        if self.parent is not None: # the root has no column 4
+            self.line[self.func_index] = '_'
+        return super().__str__()
+
+class Sentence(TokenSentence):
+    __slots__ = ()
+    token_class = Word
 
     def manage(self):
+        """
+        apply all the functional tags in one left to right pass, indices and heads are rebuilt once at the end.
+        an operation only changes the tagged word and its neighbours, so the words before it need no second look.
+        """
+        managed = False
         cur = self.root
         while cur is not None:
             if cur.func in FUNC_LIST:
                 cur.__getattribute__(cur.func)()
-                self.re_index()
-                return self.manage()
+                managed = True
             cur = cur.next
+        if managed:
+            self.re_index()
         return None
 
-    def re_index(self):
-        i = 0
-        for w in self.iter_item():
-            w.index = i
-            i += 1
-
-    def iter_item(self):
-        cur = self.root
-        while cur is not None:
-            yield cur
-            cur = cur.next
-
-    def __str__(self):
-        return ''.join([str(i) for i in self.iter_item()])
-
 
 def convert(in_file, out_file):
     with codecs.open(in_file, encoding='utf8') as fi:
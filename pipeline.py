@@ -0,0 +1,348 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    流水线
+    run the stages of a config file as one streaming pipeline, nothing is written to disk unless a stage asks for it:
+        ./pipeline.py pipeline.json [--queue_depth N]
+    config:
+        {"stages": [
+            {"name": "source", "type": "file", "path": "data/source_data"},
+            {"name": "raw", "type": "raw", "input": "source"},
+            {"name": "seg", "type": "command", "input": "raw", "command": "cws_cmdline ... --input /dev/stdin"},
+            ...
+            {"name": "merged", "type": "wsadapter", "input": ["source", "tar"], "output": "data/merged.conll"}
+        ]}
+    stage types:
+        file        text of "path"
+        command     shell "command", the input stream is written to its stdin and its stdout is the output stream
+        raw         conll => plain text, one sentence per line
+        toconll     "word pos head rel" lines of the parser => conll
+        conlltoseg  conll => words followed by a space, one sentence per line
+        wsadapter   source conll, target conll => source adapted to the target segmentation (see WSAdapter.py),
+                    options "chunk_size" and "cache_size"
+        mergepos    conll, word_pos lines => conll with the tags in the pos column (see mergepos.py)
+    a stage is run once its inputs are defined above it. a stage with "output" also writes its stream to that file,
+    the stages nobody reads are the ends of the pipeline. all the stages run at the same time: commands are processes
+    fed by a thread, the in-process stages are generators pulled by their reader, and a stream read by several stages
+    is copied to each reader by a thread.
+    pipeline_demo/ runs the stages with stand-in scripts for the ltp tools and compares the outputs with the ones of
+    the file based chain of goo.json: sh pipeline_demo/compare.sh
+"""
+import re
+import sys
+import json
+import codecs
+import queue
+import argparse
+import threading
+import subprocess
+from functools import partial
+from collections import Counter, OrderedDict
+
+from structure.data_iter import conll_lines_iter
+from WSAdapter import USED_COLUMNS, Adapter, MergeRule, SplitRule, pair_batches, adapt_batch
+from mergepos import USED_COLUMNS as POS_COLUMNS, merge_rows, conll_text
+
+CHUNK_SIZE = 1 << 16
+
+
+def iter_lines(stream):
+    """
+    lines without the ending newline from a stream of text chunks, a line may be cut between two chunks.
+    """
+    rest = ''
+    for chunk in stream:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+def rechunk(pieces, size=CHUNK_SIZE):
+    """
+    join small text pieces into chunks of about size characters, so a queue or a pipe is not used per line.
+    """
+    buf, length = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buf)
+            buf, length = [], 0
+    if buf:
+        yield ''.join(buf)
+
+
+def file_stage(path):
+    with codecs.open(path, encoding='utf8') as fi:
+        while True:
+            chunk = fi.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def command_stage(command, inputs):
+    """
+    run command in a shell, the first input (if any) is written to its stdin by a thread.
+    :raise RuntimeError: if the command exits with a non zero code
+    """
+    proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                            stdin=subprocess.PIPE if inputs else subprocess.DEVNULL)
+    errors = []
+
+    def feed():
+        try:
+            for chunk in inputs[0]:
+                proc.stdin.write(chunk.encode('utf8'))
+        except BrokenPipeError:
+            # the command stopped reading, its exit code tells the rest.
+            pass
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = None
+    if inputs:
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+    decoder = codecs.getincrementaldecoder('utf8')()
+    try:
+        while True:
+            block = proc.stdout.read1(CHUNK_SIZE)
+            if not block:
+                break
+            yield decoder.decode(block)
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+    finally:
+        proc.stdout.close()
+        if feeder is not None:
+            feeder.join()
+        proc.wait()
+    if errors:
+        raise errors[0]
+    if proc.returncode != 0:
+        raise RuntimeError('command exits with code %d: %s' % (proc.returncode, command))
+
+
+_awk_blank = re.compile(r'[ \t\n]+')
+
+
+def awk_fields(lines):
+    """
+    fields of each line, like $1 $2 ... of awk: only spaces, tabs and newlines separate them,
+    other white space (e.g. the ideographic space U+3000) is part of a field as in awk.
+    """
+    for line in lines:
+        line = line.strip(' \t\n')
+        yield _awk_blank.split(line) if line else []
+
+
+def raw_stage(inputs, sep=''):
+    """
+    same output as the "raw" (sep='') and "conlltoseg" (sep=' ') awk scripts of goo.json.
+    """
+    p = 0
+    for fields in awk_fields(iter_lines(inputs[0])):
+        if len(fields) == 0:
+            if p == 0:
+                yield '\n'
+            p = 1
+        elif fields[0] == '#':
+            pass
+        else:
+            p = 0
+            yield (fields[1] if len(fields) > 1 else '') + sep
+
+
+def toconll_stage(inputs):
+    """
+    same output as the "toconll" awk script of goo.json.
+    """
+    idx = 1
+    for fields in awk_fields(iter_lines(inputs[0])):
+        if len(fields) == 0:
+            idx = 1
+            yield '\n'
+        else:
+            fields += [''] * (4 - len(fields))
+            yield '%d\t%s\t_\t_\t%s\t_\t%s\t%s\t_\t_\n' % (idx, fields[0], fields[1], fields[2], fields[3])
+            idx += 1
+
+
+def wsadapter_stage(inputs, counter, chunk_size=500, cache_size=0):
+    work = partial(adapt_batch, adapter=Adapter([MergeRule(), SplitRule()], cache_size))
+    source = conll_lines_iter(iter_lines(inputs[0]), USED_COLUMNS)
+    tar = conll_lines_iter(iter_lines(inputs[1]), USED_COLUMNS)
+    for results, batch_counter, cache_stats, _, _ in map(work, pair_batches(source, tar, chunk_size)):
+        counter.update(batch_counter)
+        counter.update(cache_stats)
+        yield ''.join([adapted + '\n' for before, adapted in results])
+
+
+def mergepos_stage(inputs, counter):
+    """
+    a sentence that does not match its pos line is written as it is and counted as rejected_sentence.
+    """
+    source = conll_lines_iter(iter_lines(inputs[0]), POS_COLUMNS)
+    tar = (line.strip().split('\t') for line in iter_lines(inputs[1]) if line.strip() != '')
+    for rows, tokens in zip(source, tar):
+        counter.update(['rejected_sentence' if merge_rows(rows, tokens) else 'merged_sentence'])
+        yield conll_text(rows) + '\n'
+
+
+def tee_stage(stream, path):
+    with codecs.open(path, 'w', encoding='utf8') as fo:
+        for chunk in stream:
+            fo.write(chunk)
+            yield chunk
+
+
+class Broadcast(object):
+    """
+    copy one stream to several readers. the stream is pulled by its own thread and each reader has a queue,
+    queue_depth bounds the chunks a reader can fall behind (0 = no bound). a bound blocks the fast readers
+    until the slow one catches up, so it can dead lock two readers that are joined again further down.
+    """
+    __end = object()
+
+    def __init__(self, stream, readers, queue_depth=0):
+        self.stream = stream
+        self.queues = [queue.Queue(queue_depth) for _ in range(readers)]
+        self.taken = 0
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def __run(self):
+        error = None
+        try:
+            for chunk in self.stream:
+                for q in self.queues:
+                    q.put(chunk)
+        except BaseException as e:
+            error = e
+        for q in self.queues:
+            q.put((self.__end, error))
+
+    def reader(self):
+        q = self.queues[self.taken]
+        self.taken += 1
+        return self.__read(q)
+
+    def __read(self, q):
+        while True:
+            chunk = q.get()
+            if isinstance(chunk, tuple) and chunk[0] is self.__end:
+                if chunk[1] is not None:
+                    raise RuntimeError('input stream failed: %r' % chunk[1])
+                return
+            yield chunk
+
+    def start(self):
+        self.thread.start()
+
+
+class Pipeline(object):
+    INPUTS = {'file': 0, 'command': (0, 1), 'raw': 1, 'conlltoseg': 1, 'toconll': 1, 'wsadapter': 2, 'mergepos': 2}
+
+    def __init__(self, config, queue_depth=0):
+        self.queue_depth = queue_depth
+        self.counter = Counter()
+        self.stages = OrderedDict()
+        for stage in config['stages']:
+            name, kind = stage.get('name'), stage.get('type')
+            if name is None or name in self.stages:
+                raise ValueError('stage name missing or not unique: %s' % json.dumps(stage))
+            if kind not in self.INPUTS:
+                raise ValueError('stage %s has unknown type %s.' % (name, kind))
+            inputs = stage.get('input', [])
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+            expected = self.INPUTS[kind]
+            if not len(inputs) in (expected if isinstance(expected, tuple) else (expected,)):
+                raise ValueError('stage %s (%s) got %d inputs.' % (name, kind, len(inputs)))
+            for i in inputs:
+                if i not in self.stages:
+                    raise ValueError('input %s of stage %s is not defined above it.' % (i, name))
+            self.stages[name] = dict(stage, input=inputs)
+        self.readers = Counter([i for stage in self.stages.values() for i in stage['input']])
+
+    def __make(self, stage, inputs):
+        kind = stage['type']
+        if kind == 'file':
+            return file_stage(stage['path'])
+        if kind == 'command':
+            return command_stage(stage['command'], inputs)
+        if kind == 'raw':
+            return rechunk(raw_stage(inputs))
+        if kind == 'conlltoseg':
+            return rechunk(raw_stage(inputs, ' '))
+        if kind == 'toconll':
+            return rechunk(toconll_stage(inputs))
+        if kind == 'wsadapter':
+            return wsadapter_stage(inputs, self.counter, stage.get('chunk_size', 500), stage.get('cache_size', 0))
+        if kind == 'mergepos':
+            return rechunk(mergepos_stage(inputs, self.counter))
+
+    def build(self):
+        """
+        :return: streams of the last stages, broadcasts to start
+        """
+        streams, broadcasts, ends = {}, [], []
+        for name, stage in self.stages.items():
+            inputs = [streams[i].reader() if isinstance(streams[i], Broadcast) else streams[i]
+                      for i in stage['input']]
+            stream = self.__make(stage, inputs)
+            if stage.get('output'):
+                stream = tee_stage(stream, stage['output'])
+            if self.readers[name] > 1:
+                stream = Broadcast(stream, self.readers[name], self.queue_depth)
+                broadcasts.append(stream)
+            elif self.readers[name] == 0:
+                ends.append((name, stream))
+            streams[name] = stream
+        return ends, broadcasts
+
+    def run(self):
+        ends, broadcasts = self.build()
+        errors = []
+
+        def drain(name, stream):
+            try:
+                for _ in stream:
+                    pass
+            except BaseException as e:
+                errors.append((name, e))
+
+        for b in broadcasts:
+            b.start()
+        threads = [threading.Thread(target=drain, args=end, daemon=True) for end in ends]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise RuntimeError('stage %s failed: %r' % errors[0])
+        return self.counter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config', help='json file with a "stages" list.')
+    parser.add_argument('--queue_depth', type=int, default=0,
+                        help='chunks a reader of a shared stream can fall behind, 0 = no bound.')
+    args = parser.parse_args()
+    with codecs.open(args.config, encoding='utf8') as f:
+        config = json.load(f)
+    try:
+        print(Pipeline(config, args.queue_depth).run())
+    except (ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,25 @@
+#!/bin/sh
+# run the stages of pipeline_demo/pipeline.json once as the file based chain of goo.json (awk scripts, one file
+# per step) and once as one pipeline.py run, then compare their outputs. run from the repository root:
+#     sh pipeline_demo/compare.sh
+# the stand-in scripts seg.py, pos.py and par.py take the place of the ltp command line tools.
+set -e
+D=pipeline_demo
+mkdir -p $D/files $D/out
+
+awk '{if(NF==0){if(p==0)printf("\n");p=1;} else if ($1=="#") {} else {p=0;printf("%s", $2)}}' $D/source.conll > $D/files/raw.txt
+python $D/seg.py < $D/files/raw.txt > $D/files/seg.txt
+python $D/pos.py < $D/files/seg.txt > $D/files/pos.txt
+python $D/par.py < $D/files/pos.txt > $D/files/par.txt
+awk 'BEGIN {idx=1} {if(NF==0){idx=1;printf("\n")}else{printf("%d\t%s\t_\t_\t%s\t_\t%s\t%s\t_\t_\n",idx++, $1, $2, $3, $4)}}' $D/files/par.txt > $D/files/tar.conll
+python WSAdapter.py $D/source.conll $D/files/tar.conll $D/files/merged.conll --checkout none
+awk '{if(NF==0){if(p==0)printf("\n");p=1;} else if ($1=="#") {} else {p=0;printf("%s ", $2)}}' $D/files/merged.conll > $D/files/merged.seg.txt
+python $D/pos.py < $D/files/merged.seg.txt > $D/files/merged.pos.txt
+python mergepos.py $D/files/merged.conll $D/files/merged.pos.txt $D/files/merged.pos.conll
+
+python pipeline.py $D/pipeline.json
+
+for f in tar.conll merged.conll merged.seg.txt merged.pos.conll; do
+    cmp $D/files/$f $D/out/$f
+    echo "same $f"
+done
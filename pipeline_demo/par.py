@@ -0,0 +1,15 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    stand-in of par_cmdline: word_POS tokens of a sentence per line => "word pos head rel" lines separated by tabs,
+    an empty line after each sentence. the first word is the root, each other word depends on the one before it.
+"""
+import sys
+
+if __name__ == '__main__':
+    for line in sys.stdin:
+        for i, token in enumerate(line.split()):
+            word, _, pos = token.rpartition('_')
+            print('%s\t%s\t%d\t%s' % (word, pos, i, 'ATT' if i else 'HED'))
+        print()
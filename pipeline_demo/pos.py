@@ -0,0 +1,12 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    stand-in of pos_cmdline: words separated by tabs or spaces => word_POS tokens separated by tabs,
+    a word of one character is tagged v, the others n.
+"""
+import sys
+
+if __name__ == '__main__':
+    for line in sys.stdin:
+        print('\t'.join([w + ('_v' if len(w) == 1 else '_n') for w in line.split()]))
@@ -0,0 +1,13 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    stand-in of cws_cmdline: one sentence of plain text per line => its words separated by tabs,
+    every two characters are a word, so the segmentation differs from the one of the corpus.
+"""
+import sys
+
+if __name__ == '__main__':
+    for line in sys.stdin:
+        line = line.rstrip('\n')
+        print('\t'.join([line[i:i + 2] for i in range(0, len(line), 2)]))
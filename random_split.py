@@ -2,57 +2,137 @@
 # -*- coding: utf-8 -*_
 # Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
 
-import os
-import sys
-import codecs
-import math
+import bisect
 import random
+import hashlib
+import argparse
 from contextlib import ExitStack
 
+from structure.data_iter import raw_sentence_iter
+
 doc = '''
 usage:
-    ./random_split.py <filename> part_max_num1, part_max_num2, ...
-    
+    ./random_split.py <filename> part_max_num1 part_max_num2 ...    at most part_max_num sentences in each part
+    ./random_split.py <filename> 8 1 1 --mode ratio                  each sentence goes to a part with probability 8:1:1
+    ./random_split.py <filename> 8 1 1 --mode hash                   same, decided by the plain text of the sentence
+    ./random_split.py <filename> --kfold 10                          10 train / dev pairs in one pass
+
+    parts are written to <prefix>.split<n><suffix>, folds to <prefix>.fold<n>.train<suffix> and .dev<suffix>.
+    the input is read once as bytes and the sentences are copied as they are, memory use does not grow with the file.
 '''
 
-def rand_index(l):
+
+def out_name(file, middle):
+    suffix = '' if file.rfind('.',) == -1 else file[file.rfind('.'):]
+    prefix = file if file.rfind('.') == -1 else file[:file.rfind('.')]
+    return prefix + middle + suffix
+
+
+def hash_unit(raw, seed=0):
+    '''
+    number in [0, 1) decided by the plain text of a raw sentence, same sentence same number in every run.
     '''
+    plain = b''.join([line.split(b'\t', 2)[1] for line in raw.splitlines()
+                      if line.strip() and not line.lstrip().startswith(b'#')])
+    digest = hashlib.blake2b(plain, digest_size=8, key=str(seed).encode('utf8')).digest()
+    return int.from_bytes(digest, 'little') / float(1 << 64)
+
 
-    :param l: [2, 4, 4, 10]
-    :return: 10% 0 20% 1 20% 2 50% 3
+class Assigner(object):
+    '''
+    choose the part of each sentence.
+        count: part_max_num sentences at most in each part, sampling with the remaining numbers as weights
+        ratio: random part with the numbers as weights
+        hash:  part with the numbers as weights, decided by hash_unit of the sentence, with key 0 if seed is None
     '''
-    max = math.fsum(l)
-    sum_c = 0
-    sample = random.randint(0, max - 1)
-    for i in range(len(l)):
-        sum_c += l[i]
-        if sample < sum_c:
-            return i
 
+    def __init__(self, mode, weights, seed=None):
+        self.mode = mode
+        self.random = random.Random(seed)
+        self.seed = 0 if seed is None else seed
+        self.remain = [int(w) for w in weights] if mode == 'count' else None
+        self.total = sum(self.remain) if mode == 'count' else None
+        self.cum_weights = []
+        for w in weights:
+            self.cum_weights.append(w + (self.cum_weights[-1] if self.cum_weights else 0))
+
+    def __call__(self, raw):
+        '''
+        :return: part index or None if all the count parts are full.
+        '''
+        if self.mode == 'count':
+            if self.total == 0:
+                return None
+            sample = self.random.randrange(self.total)
+            for i, r in enumerate(self.remain):
+                if sample < r:
+                    self.remain[i] -= 1
+                    self.total -= 1
+                    return i
+                sample -= r
+        unit = self.random.random() if self.mode == 'ratio' else hash_unit(raw, self.seed)
+        return min(bisect.bisect_right(self.cum_weights, unit * self.cum_weights[-1]), len(self.cum_weights) - 1)
+
+
+def split(file, *split_max, mode='count', seed=None, rest=False):
+    '''
+    :param split_max: max sentence number (count mode) or weight (ratio and hash mode) of each part
+    :param rest: in count mode, write the sentences left when all the parts are full to <prefix>.rest<suffix>,
+                 otherwise the reading stops there.
+    '''
+    outfiles = [out_name(file, '.split' + str(n)) for n in range(len(split_max))]
+    assign = Assigner(mode, split_max, seed)
+    with ExitStack() as stack:
+        fos = [stack.enter_context(open(f, 'wb')) for f in outfiles]
+        frest = stack.enter_context(open(out_name(file, '.rest'), 'wb')) if rest and mode == 'count' else None
+        for raw in raw_sentence_iter(file):
+            index = assign(raw)
+            if index is not None:
+                fos[index].write(raw)
+            elif frest is not None:
+                frest.write(raw)
+            else:
+                return
+
+
+def kfold(file, k, mode='random', seed=None):
+    '''
+    write k train / dev pairs in one pass, a sentence of fold n is in the dev file of fold n and in the other train files.
+    random mode keeps the folds balanced: every k sentences are dealt to the k folds in a random order,
+    hash mode decides the fold by the plain text of the sentence.
+    '''
+    rnd = random.Random(seed)
+    assign = Assigner('hash', [1] * k, seed) if mode == 'hash' else None
+    order = []
+    with ExitStack() as stack:
+        trains = [stack.enter_context(open(out_name(file, '.fold%d.train' % n), 'wb')) for n in range(k)]
+        devs = [stack.enter_context(open(out_name(file, '.fold%d.dev' % n), 'wb')) for n in range(k)]
+        for raw in raw_sentence_iter(file):
+            if assign is not None:
+                fold = assign(raw)
+            else:
+                if not order:
+                    order = list(range(k))
+                    rnd.shuffle(order)
+                fold = order.pop()
+            for n in range(k):
+                (devs if n == fold else trains)[n].write(raw)
 
-def split(file, *split_max):
-    split_max = list(split_max)
-    suffix = '' if file.rfind('.',) == -1 else file[file.rfind('.'):]
-    prefix = file if file.rfind('.') == -1 else file[:file.rfind('.')]
-    outfiles = [prefix + '.split' + str(n) + suffix for n in range(len(split_max))]
-    with codecs.open(file, encoding='utf8') as fi:
-        with ExitStack() as stack:
-            fos = [stack.enter_context(codecs.open(f, 'w', encoding='utf8')) for f in outfiles]
-            stn = ''
-            for line in fi:
-                stn += line
-                if line == '\n':
-                    if any(split_max):
-                        index = rand_index(split_max)
-                        fo = fos[index]
-                        fo.write(stn)
-                        stn = ''
-                        split_max[index] -= 1
-                    else:
-                        return
 
 if __name__ == '__main__':
-    if sys.argv[1].startswith('-'):
-        print(doc)
-        exit(0)
-    split(sys.argv[1], *[int(i) for i in sys.argv[2:]])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=doc, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filename', help='conll file to split.')
+    parser.add_argument('parts', type=float, nargs='*', help='max sentence number or weight of each part.')
+    parser.add_argument('--mode', choices=['count', 'ratio', 'hash'], default='count')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed, the same seed gives the same split. without it the split differs in every run, '
+                             'except in hash mode, which then uses the key 0 and always gives the same split.')
+    parser.add_argument('--rest', action='store_true', help='count mode: write the sentences left to a .rest file.')
+    parser.add_argument('--kfold', type=int, default=0, metavar='K', help='write K train / dev pairs.')
+    args = parser.parse_args()
+    if args.kfold > 0:
+        kfold(args.filename, args.kfold, 'hash' if args.mode == 'hash' else 'random', args.seed)
+    elif args.parts:
+        split(args.filename, *args.parts, mode=args.mode, seed=args.seed, rest=args.rest)
+    else:
+        parser.print_help()
@@ -2,13 +2,21 @@
 # -*- coding: utf-8 -*_
 # Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
 
+import sys
+import json
+import math
 import argparse
 import codecs
 from collections import Counter
 
-from structure.word import SentenceAsTree
+from structure.word import SentenceAsArray
 from structure.data_iter import *
+from structure.memory import peak_rss_mb
+from structure.spill import SpillPartitions, merge_runs
+from structure.inverted_index import InvertedIndex
 
+# columns read by the sentences of the in-memory filter, the other ones are kept as one raw field.
+USED_COLUMNS = (0, 1, 6, 7)
 
 class SubCommand(object):
     def __init__(self, sub_parser):
@@ -37,19 +45,30 @@ class Filter(SubCommand):
         sub_parser.add_argument('--not_fit_filters', default=None, help='output filter sentence not in source file.')
         sub_parser.add_argument('--force', action='store_true',
                                 help='filter not in source will output filter sentence. So output.size = filter.size')
+        sub_parser.add_argument('--streaming', action='store_true',
+                                help='keep only sentence hash -> offset of the source in memory, '
+                                     'and copy the sentences from the original bytes.')
 
     @staticmethod
     def process(argv):
+        if argv.streaming:
+            Filter.process_streaming(argv)
+        else:
+            Filter.process_in_memory(argv)
+        print('peak memory: %.1f MB' % peak_rss_mb())
+
+    @staticmethod
+    def process_in_memory(argv):
         source_string = {}
         counter = Counter()
         not_fit_filters = []
-        for stn in conll_sentence_iter(argv.input_file):
-            sentence = SentenceAsTree(stn)
+        for stn in open_corpus(argv.input_file, USED_COLUMNS):
+            sentence = SentenceAsArray(stn)
             source_string[sentence.plain_hash()] = sentence
             counter.update(['source_sentence'])
         with codecs.open(argv.output_file, 'w', encoding='utf8') as fo:
-            for filter_stn in conll_sentence_iter(argv.filter_file):
-                sentence = SentenceAsTree(filter_stn)
+            for filter_stn in open_corpus(argv.filter_file, USED_COLUMNS):
+                sentence = SentenceAsArray(filter_stn)
                 key = sentence.plain_hash()
                 counter.update(['filter_sentence'])
                 if key in source_string:
@@ -71,9 +90,226 @@ class Filter(SubCommand):
                     ffilters.write(stn.conll_str() + '\n')
         print(counter)
 
+    @staticmethod
+    def process_streaming(argv):
+        source = open_corpus(argv.input_file)
+        filters = open_corpus(argv.filter_file)
+        # first pass: sentence fingerprint -> sentence number, the bytes are located with the corpus offset index,
+        # the fingerprints are read from the cache of the corpus if it is fresh.
+        source_offset = {}
+        counter = Counter()
+        not_fit_filters = []
+        for i in range(len(source)):
+            source_offset[source.fingerprint(i)] = i
+            counter.update(['source_sentence'])
+        with open(argv.output_file, 'wb') as fo:
+            for i in range(len(filters)):
+                key = filters.fingerprint(i)
+                counter.update(['filter_sentence'])
+                if key in source_offset:
+                    fo.write(source.raw(source_offset.pop(key)) + b'\n\n')
+                    counter.update(['in_filter_sentence'])
+                else:
+                    not_fit_filters.append(i)
+                    counter.update(['not_in_filter_sentence'])
+                    if argv.force:
+                        fo.write(filters.raw(i) + b'\n\n')
+        if argv.remain_file is not None:
+            with open(argv.remain_file, 'wb') as fremain:
+                for i in source_offset.values():
+                    fremain.write(source.raw(i) + b'\n\n')
+        if argv.not_fit_filters is not None:
+            with open(argv.not_fit_filters, 'wb') as ffilters:
+                for i in not_fit_filters:
+                    ffilters.write(filters.raw(i) + b'\n\n')
+        print(counter)
+
+
+class SetOperation(SubCommand):
+    """
+    Set operation keyed on the plain text fingerprint of the sentences, for corpora larger than memory:
+    sentences are spilled to hash partitions, each partition is solved in memory, the selected sentences of each
+    partition are sorted by (input no, sentence no) and the runs are merged, so the output keeps the input order.
+    """
+    input_nargs = '+'
+    # memory of a partition in python is about this times the size of its sentences.
+    memory_factor = 3.0
+
+    def __init__(self, sub_parser):
+        super().__init__(sub_parser)
+        sub_parser.add_argument('input_files', nargs=self.input_nargs, help='conll files.')
+        sub_parser.add_argument('output_file', help='output path.')
+        sub_parser.add_argument('--memory_mb', type=int, default=512, help='memory budget for one partition.')
+        sub_parser.add_argument('--tmp_dir', default=None, help='directory of the spill files.')
+
+    @staticmethod
+    def keep_raw(source):
+        """
+        :return: False if the sentences of this input are never output, only their keys are spilled.
+        """
+        return True
+
+    @staticmethod
+    def select(occurrences, n_inputs):
+        """
+        :param occurrences: {input no: (sentence no, raw)} first occurrence of a sentence in each input containing it
+        :return: (input no, sentence no, raw) to output or None
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def process(cls, argv):
+        inputs = argv.input_files if isinstance(argv.input_files, list) else [argv.input_files]
+        if len(inputs) > SpillPartitions.MAX_SOURCES:
+            raise ValueError('at most %d input files, got %d.' % (SpillPartitions.MAX_SOURCES, len(inputs)))
+        corpora = [open_corpus(f) for f in inputs]
+        budget = argv.memory_mb * 1024.0 * 1024.0
+        partitions = max(1, int(math.ceil(sum([c.size for c in corpora]) * cls.memory_factor / budget)))
+        counter = Counter()
+        with SpillPartitions(partitions, argv.tmp_dir) as spill:
+            for source, corpus in enumerate(corpora):
+                keep_raw = cls.keep_raw(source)
+                for i in range(len(corpus)):
+                    spill.add(source, i, corpus.fingerprint(i), corpus.raw(i) if keep_raw else b'')
+                    counter.update(['input%d_sentence' % source])
+            runs = []
+            for p, records in enumerate(spill):
+                first = {}
+                for source, seq, key, raw in records:
+                    occurrences = first.setdefault(key, {})
+                    if source in occurrences:
+                        counter.update(['duplicate_sentence'])
+                    else:
+                        occurrences[source] = (seq, raw)
+                selected = [cls.select(o, len(inputs)) for o in first.values()]
+                del first
+                runs.append(spill.run_file('run%d' % p))
+                with open(runs[-1], 'wb') as f:
+                    for source, seq, raw in sorted([r for r in selected if r is not None]):
+                        SpillPartitions.write_record(f, source, seq, b'', raw)
+            with open(argv.output_file, 'wb') as fo:
+                for source, seq, key, raw in merge_runs(runs):
+                    fo.write(raw + b'\n\n')
+                    counter.update(['output_sentence'])
+        print(counter)
+        print('peak memory: %.1f MB' % peak_rss_mb())
+
+
+class Union(SetOperation):
+    @classmethod
+    def get_help(cls):
+        return '''Output each sentence of the input files once, in the order of its first occurrence.'''
+
+    @staticmethod
+    def select(occurrences, n_inputs):
+        source = min(occurrences)
+        return (source,) + occurrences[source]
+
+
+class Intersect(SetOperation):
+    @classmethod
+    def get_help(cls):
+        return '''Output the sentences of the first input file that are in all the other input files.'''
+
+    @staticmethod
+    def keep_raw(source):
+        return source == 0
+
+    @staticmethod
+    def select(occurrences, n_inputs):
+        if len(occurrences) == n_inputs:
+            return (0,) + occurrences[0]
+        return None
+
+
+class Difference(SetOperation):
+    @classmethod
+    def get_help(cls):
+        return '''Output the sentences of the first input file that are in none of the other input files.'''
+
+    @staticmethod
+    def keep_raw(source):
+        return source == 0
+
+    @staticmethod
+    def select(occurrences, n_inputs):
+        if len(occurrences) == 1 and 0 in occurrences:
+            return (0,) + occurrences[0]
+        return None
+
+
+class Dedup(Union):
+    input_nargs = None
+
+    @classmethod
+    def get_help(cls):
+        return '''Remove the repeated sentences of the input file, the first occurrence is kept.'''
+
+
+class Query(SubCommand):
+    @classmethod
+    def get_help(cls):
+        return '''Output the sentences of input_file matching a query like "w:中国 AND (p:v OR r:SBV)".'''
+
+    def __init__(self, sub_parser):
+        super().__init__(sub_parser)
+        sub_parser.add_argument('input_file', help='conll file to search, its index is kept in input_file.inv.')
+        sub_parser.add_argument('query', help='terms w:word, b:word1+word2, p:pos, r:rel joined by AND, OR and ().')
+        sub_parser.add_argument('--output_file', default=None, help='output path, the sentences go to stdout if none.')
+        sub_parser.add_argument('--count', action='store_true', help='only count the matching sentences.')
+        sub_parser.add_argument('--limit', type=int, default=None, help='output at most this number of sentences.')
+
+    @staticmethod
+    def process(argv):
+        corpus = open_corpus(argv.input_file)
+        index = InvertedIndex(corpus)
+        counter = Counter()
+        counter.update({'indexed_sentence': index.update()})
+        matches = index.query(argv.query)
+        counter.update({'matched_sentence': len(matches)})
+        if not argv.count:
+            fo = sys.stdout.buffer if argv.output_file is None else open(argv.output_file, 'wb')
+            try:
+                for i in matches[:argv.limit]:
+                    fo.write(corpus.raw(i) + b'\n\n')
+                    counter.update(['output_sentence'])
+            finally:
+                if argv.output_file is not None:
+                    fo.close()
+        corpus.close()
+        # keep stdout for the sentences.
+        print(counter, file=sys.stderr if argv.output_file is None and not argv.count else sys.stdout)
+
+
+class Stats(SubCommand):
+    @classmethod
+    def get_help(cls):
+        return '''Write sentence and arc length histograms, pos and rel tables, roots, non projective rate and
+        mg_ws_err functional tag counts of input_file as json.'''
+
+    def __init__(self, sub_parser):
+        super().__init__(sub_parser)
+        sub_parser.add_argument('input_file', help='conll or binary conll file.')
+        sub_parser.add_argument('--output_file', default=None, help='json output path, stdout if none.')
+        sub_parser.add_argument('--block_mb', type=int, default=1, help='size of the blocks aggregated at once.')
+        sub_parser.add_argument('--jobs', type=int, default=1, help='number of processes aggregating the blocks.')
+
+    @staticmethod
+    def process(argv):
+        # numpy is only needed by this command.
+        from structure.corpus_stats import CorpusStats
+        stats = CorpusStats()
+        stats.add_file(argv.input_file, argv.block_mb << 20, argv.jobs)
+        text = json.dumps(stats.result(), ensure_ascii=False, indent=2)
+        if argv.output_file is None:
+            print(text)
+        else:
+            with codecs.open(argv.output_file, 'w', encoding='utf8') as fo:
+                fo.write(text + '\n')
+
 
 if __name__ == '__main__':
-    enabled_command_classes = [Filter]
+    enabled_command_classes = [Filter, Union, Intersect, Difference, Dedup, Query, Stats]
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(help='''The operator of the method to run on the corpus.''')
     for C in enabled_command_classes:
@@ -0,0 +1,307 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Vectorized tree check over many sentences at once, same rules as structure.tree_check.
+    A batch is a flat head array of all words plus sentence offsets:
+        heads = [2, 0, 0, 1]  offsets = [0, 2, 4]  =>  sentence 0 heads [2, 0], sentence 1 heads [0, 1]
+"""
+import numpy as np
+
+
+def _parse_ints(data, begin, end):
+    """
+    parse the decimal fields data[begin:end] of all words at once, raise ValueError if a field is not a number.
+    the digits are read from the end of the fields, the j-th digit of all the fields at least j + 1 bytes long
+    is one gather.
+    """
+    width = end - begin
+    value = np.zeros(len(begin), dtype=np.int64)
+    if len(width) == 0:
+        return value
+    min_width, max_width = int(width.min()), int(width.max())
+    if min_width <= 0 or max_width > 9:
+        raise ValueError('field is not a number.')
+    for j in range(max_width):
+        if j < min_width:
+            # a byte below '0' wraps around, so one test catches both sides.
+            digit = data[end - 1 - j] - np.uint8(48)
+            if (digit > 9).any():
+                raise ValueError('field is not a number.')
+            value += digit * np.int64(10 ** j)
+        else:
+            active = np.flatnonzero(width > j)
+            digit = data[end[active] - 1 - j] - np.uint8(48)
+            if (digit > 9).any():
+                raise ValueError('field is not a number.')
+            value[active] += digit * np.int64(10 ** j)
+    return value
+
+
+def line_table(data):
+    """
+    lines of data and their tabs, every tab and newline of data is found in one pass.
+    :return: sep, first, n_tab, line_start, line_end (without '\\r'):
+        sep holds the positions of all tabs and newlines, the tabs of line i are sep[first[i]:first[i] + n_tab[i]]
+    """
+    sep = np.flatnonzero((data - np.uint8(9)) < 2)
+    newline = np.flatnonzero(data[sep] == 10)
+    line_end = np.append(sep[newline], len(data))
+    line_start = np.concatenate(([0], line_end[:-1] + 1))
+    first = np.concatenate(([0], newline + 1))
+    n_tab = np.append(newline, len(sep)) - first
+    cr = (line_end > line_start) & (data[np.maximum(line_end - 1, 0)] == 13)
+    return sep, first, n_tab, line_start, line_end - cr
+
+
+def select_lines(table, lines):
+    """
+    the line table of some lines, lines is an index or a boolean array.
+    """
+    return (table[0],) + tuple(a[lines] for a in table[1:])
+
+
+def column_bounds(table, columns):
+    """
+    byte range of some columns in each line of a line table, raise IndexError if a line has not all of them.
+    :return: {column: (begin, end)}
+    """
+    sep, first, n_tab, line_start, line_end = table
+    last_column = max(columns)
+    if len(n_tab) and n_tab.min() < last_column:
+        raise IndexError('line shorter than %d columns.' % (last_column + 1))
+    # the j-th tab of every line, sep[j:][first] is sep[first + j] without adding j to first.
+    tabs = {}
+    for j in sorted(set([k - 1 for k in columns if k > 0] + [k for k in columns if k < last_column])):
+        tabs[j] = sep[j:][first]
+    bounds = {}
+    for k in columns:
+        begin = line_start if k == 0 else tabs[k - 1] + 1
+        if k < last_column:
+            end = tabs[k]
+        elif len(first) and first[-1] + k < len(sep):
+            # the separator after the last column is a tab or the newline.
+            end = np.minimum(sep[k:][first], line_end)
+        else:
+            end = np.where(n_tab > k, sep[np.minimum(first + k, len(sep) - 1)], line_end)
+        bounds[k] = (begin, end)
+    return bounds
+
+
+def pack_spans(buf, starts, ends, index_column=0, parent_index=6):
+    """
+    parse the index and head columns of the sentences buf[starts[i]:ends[i]] (conll bytes, see ConllCorpus)
+    without splitting the lines in python.
+    raise ValueError or IndexError on a malformed line.
+    :return: index, heads, offsets as numpy arrays
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    table = line_table(data)
+    line_start = table[3]
+    # keep the lines inside a sentence span, comments and empty lines between sentences are dropped.
+    sid = np.searchsorted(starts, line_start, side='right') - 1
+    inside = (sid >= 0) & (line_start < ends[np.maximum(sid, 0)])
+    if not inside.all():
+        table, sid = select_lines(table, inside), sid[inside]
+    offsets = np.searchsorted(sid, np.arange(len(starts) + 1))
+    bounds = column_bounds(table, (index_column, parent_index))
+    return _parse_ints(data, *bounds[index_column]), _parse_ints(data, *bounds[parent_index]), offsets
+
+
+def block_lines(data):
+    """
+    word lines of a block of whole conll sentences, lines that are empty or start with '#' end a sentence.
+    :param data: numpy uint8 array of the block
+    :return: line table of the word lines (see line_table), offsets: the lines of sentence i are offsets[i]:offsets[i+1]
+    """
+    table = line_table(data)
+    line_start, line_end = table[3], table[4]
+    empty = line_end == line_start
+    comment = ~empty & (data[np.minimum(line_start, len(data) - 1)] == 35)
+    word = ~(empty | comment)
+    # a sentence starts at a word line after a separating line or at the first line.
+    first = word & np.concatenate(([True], ~word[:-1]))
+    sid = np.cumsum(first)[word] - 1
+    offsets = np.searchsorted(sid, np.arange(int(first.sum()) + 1))
+    return select_lines(table, word), offsets
+
+
+# fields up to this many bytes are packed into two uint64 keys, longer ones are counted in python.
+PACK_WIDTH = 15
+_byte_masks = np.array([(1 << (8 * i)) - 1 for i in range(8)] + [(1 << 64) - 1], dtype=np.uint64)
+
+
+def _pack_fields(data, begin, width):
+    """
+    exact keys of fields of at most PACK_WIDTH bytes: bytes 0-7 in lo, bytes 8-14 and the width in hi.
+    all begin + 16 must be inside data.
+    """
+    # a uint64 starting at every byte of data, a key is one gather instead of 16.
+    words = np.ndarray((len(data) - 7,), dtype='<u8', buffer=data, strides=(1,))
+    lo = words[begin] & _byte_masks[np.minimum(width, 8)]
+    hi = width.astype(np.uint64) << np.uint64(56)
+    long = np.flatnonzero(width > 8)
+    if len(long):
+        hi[long] |= words[begin[long] + 8] & _byte_masks[width[long] - 8]
+    return lo, hi
+
+
+# keys are put in at most 2 ** HASH_BITS buckets by a hash, see _group_keys.
+HASH_BITS = 20
+
+
+def _group_keys(lo, hi):
+    """
+    group equal (lo, hi) keys: the first key of a hash bucket owns it and every key is compared with the owner
+    of its bucket, only the keys that differ from it (two values with the same hash) are sorted exactly.
+    :return: index of the first key of each group, counts
+    """
+    with np.errstate(over='ignore'):
+        code = (lo ^ (hi * np.uint64(0x9e3779b97f4a7c15))) * np.uint64(0xbf58476d1ce4e5b9)
+    # about as many buckets as keys, a small batch does not pay for a large table.
+    bits = min(HASH_BITS, max(8, len(lo).bit_length()))
+    bucket = (code >> np.uint64(64 - bits)).astype(np.intp)
+    owner = np.full(1 << bits, len(lo), dtype=np.intp)
+    np.minimum.at(owner, bucket, np.arange(len(lo)))
+    rep = owner[bucket]
+    same = (lo[rep] == lo) & (hi[rep] == hi)
+    counts = np.bincount(bucket[same], minlength=1 << bits)
+    used = np.flatnonzero(counts)
+    first, counts = owner[used], counts[used]
+    rest = np.flatnonzero(~same)
+    if len(rest) == 0:
+        return first, counts
+    # a key of another value is never the owner of a bucket, so these groups are new.
+    order = rest[np.lexsort((hi[rest], lo[rest]))]
+    lo, hi = lo[order], hi[order]
+    new = np.concatenate(([True], (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])))
+    starts = np.flatnonzero(new)
+    return np.concatenate((first, order[starts])), np.concatenate((counts, np.diff(np.append(starts, len(order)))))
+
+
+def field_values(data, begin, end):
+    """
+    distinct values of the fields data[begin:end] with their counts. the bytes of the fields are grouped in numpy,
+    only one field of each value is decoded.
+    :return: [value], counts
+    """
+    width = end - begin
+    short = (width <= PACK_WIDTH) & (begin + 16 <= len(data))
+    values, counts = [], []
+    if short.any():
+        b, w = (begin, width) if short.all() else (begin[short], width[short])
+        first, short_counts = _group_keys(*_pack_fields(data, b, w))
+        values = [data[b[i]:b[i] + w[i]].tobytes().decode('utf8') for i in first]
+        counts = short_counts.tolist()
+    if not short.all():
+        # long fields and the last fields of data, a value is never in both parts as the widths differ
+        # except near the end, so the two parts are summed by value.
+        table = dict(zip(values, counts))
+        for i in np.flatnonzero(~short):
+            value = data[begin[i]:end[i]].tobytes().decode('utf8')
+            table[value] = table.get(value, 0) + 1
+        values, counts = list(table), list(table.values())
+    return values, np.asarray(counts, dtype=np.int64)
+
+
+def _sparse_table(values, reduce, levels):
+    """
+    row k holds the reduce of values[i:i + 2 ** k] at column i, the tail of a row is not used.
+    """
+    table = np.empty((levels + 1, len(values)), dtype=values.dtype)
+    table[0] = values
+    step = 1
+    for k in range(1, levels + 1):
+        reduce(table[k - 1, :-step], table[k - 1, step:], out=table[k, :-step])
+        table[k, -step:] = table[k - 1, -step:]
+        step *= 2
+    return table
+
+
+def validate_batch(heads, offsets, index=None, single_root=False, with_projective=False):
+    """
+    :param heads: flat head array of all words, 0 for root
+    :param offsets: sentence i is heads[offsets[i]:offsets[i+1]]
+    :param index: optional flat word index column, must be 1..n in every sentence
+    :param with_projective: return the projective and tree arrays too, projective is False for the trees with
+        crossing arcs (like the non_projective of tree_check, a sentence that is not a tree is not non projective),
+        tree is False for the sentences with a bad index, a head out of range or a cycle
+    :return: (valid, roots) boolean and count arrays with one value per sentence
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_stn = len(offsets) - 1
+    n_word = len(heads)
+    # positions fit in 32 bits for any batch that fits in memory, and the gathers below move half the bytes.
+    itype = np.int32 if n_word + n_stn < 2 ** 31 else np.int64
+    heads = np.asarray(heads).astype(itype, copy=False)
+    offsets = offsets.astype(itype)
+    lengths = np.diff(offsets)
+    valid = np.ones(n_stn, dtype=bool)
+    if n_word == 0:
+        roots = np.zeros(n_stn, dtype=np.int64)
+        return (valid, roots, valid.copy(), valid.copy()) if with_projective else (valid, roots)
+    sid = np.repeat(np.arange(n_stn, dtype=itype), lengths)
+    first = offsets[sid]
+    local = np.arange(1, n_word + 1, dtype=itype) - first
+    if index is not None:
+        valid[sid[np.asarray(index) != local]] = False
+    in_range = (heads >= 0) & (heads <= lengths[sid])
+    # a head out of range is not a root, it is only attached to the root to end the walks below.
+    roots = np.bincount(sid[(heads == 0) & in_range], minlength=n_stn)
+    if not in_range.all():
+        valid[sid[~in_range]] = False
+        heads = np.where(in_range, heads, 0)
+    is_root = heads == 0
+
+    # cycle: pointer jumping, every word reaches the root sentinel (n_word) in at most max length steps.
+    # only the words that have not reached it jump again, few are left after the first rounds.
+    ptr = np.empty(n_word + 1, dtype=itype)
+    np.add(first, heads - 1, out=ptr[:n_word])
+    ptr[:n_word][is_root] = n_word
+    ptr[n_word] = n_word
+    todo = np.flatnonzero(~is_root)
+    for _ in range(int(lengths.max()).bit_length() + 1):
+        if len(todo) == 0:
+            break
+        ptr[todo] = ptr[ptr[todo]]
+        todo = todo[ptr[todo] != n_word]
+    valid[sid[todo]] = False
+    tree = valid.copy()
+    if single_root:
+        valid &= roots == 1
+
+    # crossing arcs: root of sentence i is put at offsets[i] + i, so each sentence is a contiguous slot range.
+    # an arc is crossed if a word strictly inside it has an arc going out of it, lo and hi are the farthest
+    # ends of the arcs of each slot and their range min and max come from a sparse table.
+    shift = first + sid
+    dep = shift + local
+    head = shift + heads
+    lo = np.arange(n_word + n_stn, dtype=itype)
+    hi = lo.copy()
+    left = np.minimum(dep, head)
+    right = np.maximum(dep, head)
+    lo[dep] = left
+    hi[dep] = right
+    np.minimum.at(lo, head, dep)
+    np.maximum.at(hi, head, dep)
+    # only arcs with a word inside them can be crossed.
+    arcs = np.flatnonzero(right - left > 1)
+    projective = np.ones(n_stn, dtype=bool)
+    if len(arcs) == 0:
+        return (valid, roots, projective, tree) if with_projective else (valid, roots)
+    left, right = left[arcs], right[arcs]
+    begin, end = left + 1, right - 1
+    # level k covers 2 ** k slots, two overlapping windows of it cover [begin, end].
+    level = np.log2(end - begin + 1).astype(itype)
+    levels = int(level.max())
+    mins = _sparse_table(lo, np.minimum, levels)
+    maxs = _sparse_table(hi, np.maximum, levels)
+    last = end - (1 << level) + 1
+    crossed = (np.minimum(mins[level, begin], mins[level, last]) < left) | \
+              (np.maximum(maxs[level, begin], maxs[level, last]) > right)
+    projective[sid[arcs[crossed]]] = False
+    projective |= ~tree
+    valid &= projective
+    return (valid, roots, projective, tree) if with_projective else (valid, roots)
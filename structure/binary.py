@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Compact binary conll corpus.
+    index and head columns are packed integer arrays, the other columns are ids into one vocabulary per column,
+    so no text is split when reading. layout (little endian, every section 8 bytes aligned):
+        header          magic, version, sentence number, token number, array typecode of the 10 columns
+        offsets         uint64 [sentences + 1]  first token of each sentence
+        columns         uint8  [tokens]         column number of each token line
+        index, head     int8/16/32 [tokens]     smallest type holding the column
+        ids             uint8/16/32 [tokens]    for each string column 1, 2, 3, 4, 5, 7, 8, 9
+        vocabularies    for each string column: uint64 byte length, utf8 words joined by '\n'
+"""
+import sys
+import mmap
+import struct
+from array import array
+
+from structure.fingerprint import fingerprint
+
+MAGIC = b'CONLLBIN'
+VERSION = 1
+N_COLUMNS = 10
+INT_COLUMNS = (0, 6)
+STR_COLUMNS = (1, 2, 3, 4, 5, 7, 8, 9)
+SPLIT_CHAR = '\t'
+_header = struct.Struct('<8sIIQQ10s')
+
+
+def is_binary(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _little(a):
+    if sys.byteorder == 'big':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a
+
+
+def _packed(a, signed):
+    """
+    copy of the int array a in the smallest typecode holding its values.
+    """
+    for typecode in ('bhi' if signed else 'BHI'):
+        try:
+            return array(typecode, a)
+        except OverflowError:
+            continue
+    return a
+
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % 8))
+
+
+def write_binary(sentences, out_file):
+    """
+    :param sentences: iterator of sentences as split conll lines (see conll_sentence_iter)
+    :return: number of sentences written
+    """
+    offsets = array('Q', [0])
+    columns = array('B')
+    ints = {c: array('i') for c in INT_COLUMNS}
+    ids = {c: array('I') for c in STR_COLUMNS}
+    vocabs = {c: {} for c in STR_COLUMNS}
+    for stn in sentences:
+        for line in stn:
+            if len(line) <= max(INT_COLUMNS) + 1 or len(line) > N_COLUMNS:
+                raise ValueError('Input line mast have %d to %d columns: %s'
+                                 % (max(INT_COLUMNS) + 2, N_COLUMNS, SPLIT_CHAR.join(line)))
+            columns.append(len(line))
+            for c in INT_COLUMNS:
+                ints[c].append(int(line[c]))
+            for c in STR_COLUMNS:
+                if c < len(line):
+                    vocab = vocabs[c]
+                    word = line[c]
+                    if word not in vocab:
+                        vocab[word] = len(vocab)
+                    ids[c].append(vocab[word])
+                else:
+                    ids[c].append(0)
+        offsets.append(len(columns))
+    packed = {c: _packed(ints[c], True) for c in INT_COLUMNS}
+    packed.update({c: _packed(ids[c], False) for c in STR_COLUMNS})
+    typecodes = ''.join([packed[c].typecode for c in range(N_COLUMNS)]).encode('ascii')
+    with open(out_file, 'wb') as f:
+        f.write(_header.pack(MAGIC, VERSION, N_COLUMNS, len(offsets) - 1, len(columns), typecodes))
+        for a in [offsets, columns] + [packed[c] for c in range(N_COLUMNS)]:
+            _pad(f)
+            _little(a).tofile(f)
+        for c in STR_COLUMNS:
+            _pad(f)
+            data = '\n'.join(vocabs[c]).encode('utf8')
+            f.write(struct.pack('<Q', len(data)))
+            f.write(data)
+    return len(offsets) - 1
+
+
+class BinaryCorpus(object):
+    """
+    Random access reader of the binary corpus, same interface as data_iter.ConllCorpus:
+        len(corpus), corpus[10], corpus[10:20], corpus.raw(10), corpus.fingerprint(10)
+    and the head column of a sentence range without building any line: corpus.head_batch(0, 1000)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.mm)
+        magic, version, n_columns, n_stn, n_token, typecodes = _header.unpack_from(self.mm, 0)
+        if not (magic == MAGIC and version == VERSION and n_columns == N_COLUMNS):
+            raise ValueError('%s is not a binary conll corpus of version %d.' % (filename, VERSION))
+        typecodes = typecodes.decode('ascii')
+        self.pos = _header.size
+        self.offsets = self.__section('Q', n_stn + 1)
+        self.columns = self.__section('B', n_token)
+        sections = [self.__section(typecodes[c], n_token) for c in range(N_COLUMNS)]
+        self.ints = {c: sections[c] for c in INT_COLUMNS}
+        self.ids = {c: sections[c] for c in STR_COLUMNS}
+        self.vocabs = {}
+        for c in STR_COLUMNS:
+            self.pos += -self.pos % 8
+            length, = struct.unpack_from('<Q', self.mm, self.pos)
+            self.pos += 8
+            self.vocabs[c] = self.mm[self.pos:self.pos + length].decode('utf8').split('\n')
+            self.pos += length
+
+    def __section(self, typecode, count):
+        self.pos += -self.pos % 8
+        begin = self.pos
+        self.pos += count * array(typecode).itemsize
+        view = memoryview(self.mm)[begin:self.pos].cast(typecode)
+        return _little(array(typecode, view)) if sys.byteorder == 'big' else view
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        a, b = self.offsets[i], self.offsets[i + 1]
+        cols = [None] * N_COLUMNS
+        for c in INT_COLUMNS:
+            cols[c] = [str(x) for x in self.ints[c][a:b]]
+        for c in STR_COLUMNS:
+            vocab = self.vocabs[c]
+            cols[c] = [vocab[x] for x in self.ids[c][a:b]]
+        return [list(line[:n]) for line, n in zip(zip(*cols), self.columns[a:b])]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def forms(self, i):
+        vocab = self.vocabs[1]
+        return [vocab[x] for x in self.ids[1][self.offsets[i]:self.offsets[i + 1]]]
+
+    def raw(self, i):
+        """conll text of the i-th sentence as utf8 bytes, without the ending newline."""
+        return '\n'.join([SPLIT_CHAR.join(line) for line in self[i]]).encode('utf8')
+
+    def fingerprint(self, i):
+        return fingerprint(''.join(self.forms(i)))
+
+    def head_batch(self, begin, end):
+        """
+        :return: index, heads, offsets of sentences [begin, end), as for structure.batch_check.validate_batch
+        """
+        a, b = self.offsets[begin], self.offsets[end]
+        return self.ints[0][a:b], self.ints[6][a:b], [o - a for o in self.offsets[begin:end + 1]]
+
+    def close(self):
+        for view in [self.offsets, self.columns] + list(self.ints.values()) + list(self.ids.values()):
+            if isinstance(view, memoryview):
+                view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def binary_sentence_iter(filename):
+    with BinaryCorpus(filename) as corpus:
+        for stn in corpus:
+            yield stn
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Checkpoint of a long run over sentence aligned files, saved as json in `output_file + '.ckpt'`:
+    the byte offsets of the inputs after the last written sentence, the byte offsets of the outputs,
+    the number of sentences and the counters at that point.
+    the outputs are flushed to disk before the checkpoint is replaced, so a run that dies goes on from the last one.
+        ckpt = Checkpoint('out.conll.ckpt', [src, tar])
+        state = ckpt.load() if resume else None
+        ...
+        fo.flush(sync=True)
+        ckpt.save(input_offsets, {'out': fo.tell()}, sentences, {'counter': counter})
+"""
+import os
+import json
+from collections import Counter
+
+from structure.binary import is_binary
+
+VERSION = 1
+
+
+def check_text_inputs(filenames):
+    """
+    raise ValueError if an input is a binary corpus, it has no byte offsets of sentences to go on from.
+    to be called before any output is opened, a failed run must not cut the outputs of the last one.
+    """
+    for name in filenames:
+        if is_binary(name):
+            raise ValueError('%s: binary corpus, --checkpoint_every and --resume need a conll file, '
+                             'convert it back to conll first.' % name)
+
+
+class Checkpoint(object):
+    SUFFIX = '.ckpt'
+
+    def __init__(self, filename, inputs):
+        """
+        :param inputs: input file names, a checkpoint of other inputs is not used
+        """
+        self.filename = filename
+        self.inputs = [os.path.abspath(i) for i in inputs]
+
+    def load(self):
+        """
+        :return: None if there is no checkpoint, the saved state otherwise,
+            dict with input_offsets, output_offsets, sentences and counters (name => Counter)
+        """
+        try:
+            with open(self.filename, encoding='utf8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if not state.get('version') == VERSION:
+            raise ValueError('%s: unknown checkpoint version %s.' % (self.filename, state.get('version')))
+        if not state['inputs'] == self.inputs:
+            raise ValueError('%s is a checkpoint of %s.' % (self.filename, ' '.join(state['inputs'])))
+        for name, offset in zip(state['inputs'], state['input_offsets']):
+            if os.path.getsize(name) < offset:
+                raise ValueError('%s is shorter than its checkpoint offset %d.' % (name, offset))
+        state['counters'] = {name: Counter(c) for name, c in state['counters'].items()}
+        return state
+
+    def save(self, input_offsets, output_offsets, sentences, counters):
+        """
+        replace the checkpoint in one step, the outputs have to be on disk already (ConllWriter.flush(sync=True)).
+        :param output_offsets: output name => byte offset (ConllWriter.tell)
+        :param counters: name => Counter
+        """
+        state = {
+            'version': VERSION,
+            'inputs': self.inputs,
+            'input_offsets': list(input_offsets),
+            'output_offsets': output_offsets,
+            'sentences': sentences,
+            'counters': {name: dict(c) for name, c in counters.items()},
+        }
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Buffered conll output: the written strings are kept in a list and encoded into one bytes buffer
+    of about buffer_size characters, which is written to the file with a single call.
+    With background=True the encoding and writing are done by a thread, the caller only appends.
+        with ConllWriter('out.conll') as fo:
+            fo.write(sentence.conll_str() + '\n')
+"""
+import os
+import queue
+import threading
+
+
+class ConllWriter(object):
+
+    def __init__(self, filename, buffer_size=1 << 22, background=False, queue_depth=4, encoding='utf8', offset=None):
+        """
+        :param buffer_size: characters kept before a chunk is encoded and written
+        :param queue_depth: chunks waiting for the background thread, the caller blocks when it is full
+        :param offset: go on writing an existing file at this byte offset (see tell), what is after it is cut off
+        """
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.pieces = []
+        self.length = 0
+        if offset is None:
+            self.file = open(filename, 'wb')
+        else:
+            self.file = open(filename, 'r+b')
+            if os.fstat(self.file.fileno()).st_size < offset:
+                self.file.close()
+                raise ValueError('%s is shorter than %d bytes.' % (filename, offset))
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if background:
+            self.queue = queue.Queue(queue_depth)
+            self.thread = threading.Thread(target=self.__run, daemon=True)
+            self.thread.start()
+
+    def __write_chunk(self, pieces):
+        self.file.write(''.join(pieces).encode(self.encoding))
+
+    def __run(self):
+        while True:
+            pieces = self.queue.get()
+            if pieces is None:
+                return
+            if self.error is None:
+                try:
+                    self.__write_chunk(pieces)
+                except BaseException as e:
+                    # keep draining the queue so the caller never blocks, the error is raised by flush or close.
+                    self.error = e
+
+    def __check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write(self, text):
+        self.pieces.append(text)
+        self.length += len(text)
+        if self.length >= self.buffer_size:
+            self.__send()
+
+    def writelines(self, texts):
+        for text in texts:
+            self.write(text)
+
+    def __send(self):
+        pieces, self.pieces, self.length = self.pieces, [], 0
+        if not pieces:
+            return
+        if self.queue is None:
+            self.__write_chunk(pieces)
+        else:
+            self.__check()
+            self.queue.put(pieces)
+
+    def flush(self, sync=False):
+        """
+        write the buffered text, wait for the background thread to write it too.
+        :param sync: also wait until the file is on disk
+        """
+        self.__send()
+        if self.queue is not None:
+            # the thread stops after writing the chunks queued before the marker, then a new one takes over.
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = threading.Thread(target=self.__run, daemon=True)
+            self.thread.start()
+        self.__check()
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def tell(self):
+        """
+        byte offset of the text written so far, after a flush.
+        """
+        return self.file.tell()
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            self.__send()
+            if self.queue is not None:
+                self.queue.put(None)
+                self.thread.join()
+            self.__check()
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Linked token and sentence core of mg_ws_err.py and of structure.word (WordWithRel, SentenceAsTree).
+    tokens have __slots__ and no per-instance dict, the children list is only made for a token that gets one.
+"""
+SPLIT_CHAR = '\t'
+# functional tags of mg_ws_err.py in column 4.
+FUNC_LIST = ['MR', 'ML', 'M1R', 'M1L', 'M2R', 'M2L']
+ROOT_LINE = ('0', '<ROOT>')
+
+
+class PlainWord(object):
+    __slots__ = ('word', 'next', 'pre')
+
+    def __init__(self, word):
+        self.word = word
+        self.next = None
+        self.pre = None
+
+    def __len__(self):
+        return len(self.word)
+
+    def __str__(self):
+        return self.word
+
+
+class Token(PlainWord):
+    __slots__ = ('line', 'index', 'parent', 'func', '_children')
+    idx_index = 0
+    word_index = 1
+    func_index = 3
+    parent_index = 6
+
+    def __init__(self, line):
+        """
+        :param line: split conll line, a missing column is None.
+        """
+        n = len(line)
+        super().__init__(line[1] if n > 1 else None)
+        self.line = line
+        self.index = int(line[0]) if n > 0 else None
+        self.func = line[3] if n > 3 else None
+        self.parent = int(line[6]) if n > 6 else None
+        self._children = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = []
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
+
+    def has_children(self):
+        return bool(self._children)
+
+    def __str__(self):
+        if self.parent is None: # skip root
+            return ''
+        self.line[self.idx_index] = str(self.index)
+        self.line[self.word_index] = self.word
+        self.line[self.parent_index] = str(self.parent.index)
+        return SPLIT_CHAR.join(self.line) + '\n'
+
+
+class TokenSentence(object):
+    __slots__ = ('root',)
+    token_class = Token
+
+    def __init__(self, stn=None):
+        self.root = self.token_class(list(ROOT_LINE))
+        if stn is not None:
+            self.init(stn)
+
+    def init(self, stn):
+        """
+        link the tokens of the split conll lines stn: parent, children, pre and next.
+        pre and next follow the index column, parents the head column.
+        """
+        cls = self.token_class
+        words = [self.root]
+        words += [cls(line) for line in stn]
+        n = len(words)
+        for w in words:
+            if w.parent is not None:
+                w.parent = parent = words[w.parent]
+                if parent._children is None:
+                    parent._children = [w]
+                else:
+                    parent._children.append(w)
+            i = w.index
+            w.next = words[i + 1] if i + 1 < n else None
+            w.pre = words[i - 1] if i - 1 >= 0 else None
+
+    def re_index(self):
+        i = 0
+        for w in self.iter_item():
+            w.index = i
+            i += 1
+
+    def iter_item(self):
+        cur = self.root
+        while cur is not None:
+            yield cur
+            cur = cur.next
+
+    def __len__(self):
+        return len([1 for i in self.iter_item()])
+
+    def __str__(self):
+        return ''.join([str(i) for i in self.iter_item()])
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Corpus statistics in one pass: the file is memory-mapped and cut into large blocks after an empty line, every block
+    is aggregated with numpy (see structure.batch_check), python only sees the distinct values of a column.
+    with jobs > 1 the blocks are aggregated by worker processes and their stats are merged in block order.
+        stats = CorpusStats()
+        stats.add_file('train.conll', jobs=4)
+        json.dump(stats.result(), f)
+"""
+import mmap
+import multiprocessing
+from functools import partial
+from collections import Counter
+
+import numpy as np
+
+from structure.batch_check import block_lines, column_bounds, field_values, _parse_ints, validate_batch
+from structure.binary import is_binary, BinaryCorpus
+from structure.core import FUNC_LIST
+from structure.data_iter import conll_lines_iter
+
+# column => name of its frequency table
+TABLE_COLUMNS = {3: 'cpos', 4: 'pos', 7: 'rel'}
+_blank_line_ends = (b'\n\n', b'\n\r\n')
+
+
+def _add_histogram(histogram, values):
+    counts = np.bincount(values)
+    if len(counts) > len(histogram):
+        histogram = np.concatenate((histogram, np.zeros(len(counts) - len(histogram), dtype=np.int64)))
+    histogram[:len(counts)] += counts
+    return histogram
+
+
+def _sum_histograms(a, b):
+    if len(b) > len(a):
+        a, b = b, a
+    a = a.copy()
+    a[:len(b)] += b
+    return a
+
+
+def block_ranges(data, block_size):
+    """
+    (begin, end) of the blocks of about block_size bytes of data, each block ends after an empty line
+    or at the end of data. a sentence longer than block_size makes a longer block.
+    """
+    size = len(data)
+    begin = 0
+    while begin < size:
+        end = begin + block_size
+        if end >= size:
+            yield begin, size
+            return
+        cut = begin
+        for e in _blank_line_ends:
+            # only a later empty line matters, it may start in the last bytes of the one found before.
+            at = data.rfind(e, max(begin, cut - 2), end)
+            if at >= 0:
+                cut = max(cut, at + len(e))
+        if cut <= begin:
+            # no empty line in the block, it goes on to the next one.
+            found = [data.find(e, end) + len(e) for e in _blank_line_ends if data.find(e, end) >= 0]
+            cut = min(found) if found else size
+        yield begin, cut
+        begin = cut
+
+
+def _block_stats(filename, block):
+    """
+    stats of the block (begin, end) of a text corpus, run in a worker process.
+    """
+    stats = CorpusStats()
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        stats.add_block(mm[block[0]:block[1]])
+    finally:
+        mm.close()
+    return stats
+
+
+def _histogram_json(histogram):
+    total = int(histogram.sum())
+    values = np.arange(len(histogram))
+    return {
+        'count': total,
+        'mean': float((values * histogram).sum()) / total if total else 0.0,
+        'max': int(np.flatnonzero(histogram).max()) if total else 0,
+        'histogram': {str(v): int(c) for v, c in enumerate(histogram) if c},
+    }
+
+
+class CorpusStats(object):
+
+    def __init__(self):
+        self.sentences = 0
+        self.tokens = 0
+        self.sentence_length = np.zeros(0, dtype=np.int64)
+        self.arc_length = np.zeros(0, dtype=np.int64)
+        self.roots = np.zeros(0, dtype=np.int64)
+        self.invalid = 0
+        self.non_projective = 0
+        self.tables = {c: Counter() for c in TABLE_COLUMNS}
+        self.counter = Counter()
+
+    def add_heads(self, index, heads, offsets):
+        """
+        :param index: flat index column of the words of a batch of sentences
+        :param heads: flat head column
+        :param offsets: sentence i is heads[offsets[i]:offsets[i+1]]
+        """
+        index = np.asarray(index, dtype=np.int64)
+        heads = np.asarray(heads, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        self.sentences += len(lengths)
+        self.tokens += len(heads)
+        self.sentence_length = _add_histogram(self.sentence_length, lengths)
+        arcs = heads > 0
+        self.arc_length = _add_histogram(self.arc_length, np.abs(index[arcs] - heads[arcs]))
+        # roots and projectivity are about the sentences that are trees, the others are only counted.
+        _, roots, projective, tree = validate_batch(heads, offsets, index, with_projective=True)
+        self.roots = _add_histogram(self.roots, roots[tree])
+        self.invalid += int((~tree).sum())
+        self.non_projective += int((~projective).sum())
+
+    def add_values(self, column, values, counts):
+        self.tables[column].update(dict(zip(values, [int(c) for c in counts])))
+
+    def merge(self, other):
+        """
+        add the stats of another part of the corpus.
+        """
+        self.sentences += other.sentences
+        self.tokens += other.tokens
+        self.sentence_length = _sum_histograms(self.sentence_length, other.sentence_length)
+        self.arc_length = _sum_histograms(self.arc_length, other.arc_length)
+        self.roots = _sum_histograms(self.roots, other.roots)
+        self.invalid += other.invalid
+        self.non_projective += other.non_projective
+        for c in TABLE_COLUMNS:
+            self.tables[c].update(other.tables[c])
+        self.counter.update(other.counter)
+
+    def add_block(self, buf):
+        """
+        :param buf: bytes of whole sentences, or any buffer of them
+        """
+        data = np.frombuffer(buf, dtype=np.uint8)
+        table, offsets = block_lines(data)
+        try:
+            bounds = column_bounds(table, (0, 6) + tuple(TABLE_COLUMNS))
+            index, heads = _parse_ints(data, *bounds[0]), _parse_ints(data, *bounds[6])
+        except (ValueError, IndexError):
+            self.add_lines(bytes(buf).decode('utf8').splitlines())
+            return
+        self.add_heads(index, heads, offsets)
+        for c in TABLE_COLUMNS:
+            self.add_values(c, *field_values(data, *bounds[c]))
+
+    def add_lines(self, lines):
+        """
+        slow path of a block with a malformed line, the malformed sentences are only counted.
+        """
+        index, heads, offsets = [], [], [0]
+        for stn in conll_lines_iter(lines):
+            try:
+                stn_index = [int(line[0]) for line in stn]
+                stn_heads = [int(line[6]) for line in stn]
+                values = [[line[c] for line in stn] for c in TABLE_COLUMNS]
+            except (ValueError, IndexError):
+                self.counter.update(['malformed_sentence'])
+                continue
+            index += stn_index
+            heads += stn_heads
+            offsets.append(len(heads))
+            for c, column_values in zip(TABLE_COLUMNS, values):
+                self.tables[c].update(column_values)
+        self.add_heads(index, heads, offsets)
+
+    def add_file(self, filename, block_size=1 << 20, jobs=1):
+        """
+        :param block_size: bytes aggregated at once, the arrays of a block of about 1MB stay in the cpu cache
+        :param jobs: number of worker processes aggregating the blocks
+        """
+        if is_binary(filename):
+            self.add_binary(filename)
+            return
+        with open(filename, 'rb') as f:
+            if f.seek(0, 2) == 0:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            blocks = list(block_ranges(mm, block_size))
+            if jobs > 1 and len(blocks) > 1:
+                with multiprocessing.Pool(min(jobs, len(blocks))) as pool:
+                    # imap keeps the block order, so the tables are the same as in one process.
+                    for stats in pool.imap(partial(_block_stats, filename), blocks, chunksize=16):
+                        self.merge(stats)
+                return
+            with memoryview(mm) as view:
+                for begin, end in blocks:
+                    block = view[begin:end]
+                    self.add_block(block)
+                    # the views of the memory map have to go before it is closed.
+                    block.release()
+        finally:
+            mm.close()
+
+    def add_binary(self, filename, batch_size=1 << 20):
+        with BinaryCorpus(filename) as corpus:
+            for begin in range(0, len(corpus), batch_size):
+                end = min(begin + batch_size, len(corpus))
+                index, heads, offsets = corpus.head_batch(begin, end)
+                self.add_heads(index, heads, offsets)
+                a, b = corpus.offsets[begin], corpus.offsets[end]
+                n_columns = np.asarray(corpus.columns[a:b])
+                for c in TABLE_COLUMNS:
+                    ids = np.asarray(corpus.ids[c][a:b])[n_columns > c]
+                    counts = np.bincount(ids, minlength=len(corpus.vocabs[c]))
+                    # the vocabulary is the one of the whole corpus, a value not in this batch is not counted.
+                    nz = counts.nonzero()[0]
+                    self.add_values(c, [corpus.vocabs[c][i] for i in nz], counts[nz])
+                # the views of the memory map have to go before it is closed.
+                del index, heads, n_columns
+
+    def result(self):
+        """
+        :return: dict for json
+        """
+        trees = self.sentences - self.invalid
+        out = {
+            'sentences': self.sentences,
+            'tokens': self.tokens,
+            'sentence_length': _histogram_json(self.sentence_length),
+            'arc_length': _histogram_json(self.arc_length),
+            'roots': {str(v): int(c) for v, c in enumerate(self.roots) if c},
+            'invalid_tree': self.invalid,
+            'non_projective': self.non_projective,
+            # rate among the trees, invalid_tree sentences are neither projective nor non projective.
+            'non_projective_rate': float(self.non_projective) / trees if trees else 0.0,
+        }
+        for c, name in TABLE_COLUMNS.items():
+            out[name] = dict(self.tables[c].most_common())
+        out['func_tags'] = {tag: self.tables[3][tag] for tag in FUNC_LIST}
+        out.update(self.counter)
+        return out
@@ -1,29 +1,384 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*_
 # Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
-import codecs
+import os
+import re
+import mmap
+import queue
+import zlib
+import struct
+import threading
+from array import array
 
+from structure.fingerprint import DIGEST_SIZE, raw_fingerprint
+from structure.binary import is_binary, binary_sentence_iter, BinaryCorpus
 
-def conll_sentence_iter(filename):
-    with codecs.open(filename, encoding='utf8') as fi:
-        lines = []
+
+def decoded_lines(filename, block_size=1 << 22, encoding='utf8', offset=0, with_offsets=False):
+    """
+    lines of a text file without line ends, read in blocks of block_size bytes cut at a newline.
+    lines are split as by codecs.open, a decoding error tells the line number and the line.
+    :param offset: byte offset to start reading at, line numbers count from there
+    :param with_offsets: yield (line, byte offset after the line end) instead
+    """
+    line_num = 0
+    with open(filename, 'rb') as fi:
+        fi.seek(offset)
+        rest = b''
+        while True:
+            block = fi.read(block_size)
+            buf = rest + block
+            cut = len(buf) if not block else buf.rfind(b'\n') + 1
+            chunk, rest = buf[:cut], buf[cut:]
+            try:
+                lines = chunk.decode(encoding).splitlines()
+            except UnicodeDecodeError as e:
+                begin = chunk.rfind(b'\n', 0, e.start) + 1
+                end = chunk.find(b'\n', e.start)
+                line = chunk[begin:len(chunk) if end == -1 else end].decode(encoding, 'replace')
+                # the lines before the bad one are read first, as by a line by line reader.
+                for good in chunk[:begin].decode(encoding).splitlines(True):
+                    offset += len(good.encode(encoding))
+                    yield (good.splitlines()[0], offset) if with_offsets else good.splitlines()[0]
+                raise UnicodeDecodeError(e.encoding, e.object, e.start, e.end, '%s line:%d [%s]'
+                                         % (e.reason, line_num + chunk.count(b'\n', 0, e.start) + 1, line))
+            if with_offsets:
+                # the byte length of a line is its encoded length with the line end.
+                for line, raw in zip(lines, chunk.decode(encoding).splitlines(True)):
+                    offset += len(raw.encode(encoding))
+                    yield line, offset
+            else:
+                for line in lines:
+                    yield line
+            line_num += chunk.count(b'\n')
+            if not block:
+                return
+
+
+def prefetch_iter(items, queue_depth=8, batch_size=256):
+    """
+    pull items in a background thread and hand them over in batches through a bounded queue,
+    so reading and decoding overlap with the work of the caller. errors of the thread are raised by the caller.
+    """
+    q = queue.Queue(queue_depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        batch = []
         try:
-            for line_num, i in enumerate(fi):
-                i = i.strip()
-                if (i == '' or i.startswith('#')) and len(lines):
-                    yield lines
-                    lines = []
-                elif not (i == '' or i.startswith('#')):
-                    lines.append(i.split('\t'))
-            if len(lines):
-                yield lines
-        except UnicodeDecodeError as e:
-            raise UnicodeDecodeError(str(e) + ('line:%d [%s]' % (line_num, i)))
-
-
-def ws_sentence_iter(filename):
-    with codecs.open(filename, encoding='utf8') as fi:
-        for i in fi:
-            i = i.strip()
-            if not i == '':
-                yield i.split('\t')
+            for item in items:
+                batch.append(item)
+                if len(batch) == batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            result = end
+        except BaseException as e:
+            # the items before the error are handed over first.
+            result = e
+        if batch:
+            put(batch)
+        put(result)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = q.get()
+            if batch is end:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            for item in batch:
+                yield item
+    finally:
+        # the caller may stop early, let the thread leave its put.
+        stop.set()
+
+
+def conll_sentence_iter(filename, columns=None, prefetch=False, block_size=1 << 22, queue_depth=8,
+                        offset=0, with_offsets=False):
+    """
+    :param columns: column indices the caller reads or writes, e.g. (0, 1, 6, 7). only the columns up to the largest
+        one are split, the rest of the line is kept as one raw last field, which '\t'.join writes back verbatim.
+        all the columns are split if None.
+    :param prefetch: read, decode and split the sentences in a background thread, see prefetch_iter
+    :param offset: byte offset to start reading at, e.g. an offset given with_offsets
+    :param with_offsets: yield (sentence, byte offset after the line that ends it), a text corpus only
+    """
+    if is_binary(filename):
+        if offset or with_offsets:
+            raise ValueError('byte offsets of %s: binary corpus, convert it back to conll first.' % filename)
+        sentences = binary_sentence_iter(filename)
+    elif with_offsets:
+        sentences = conll_offset_lines_iter(decoded_lines(filename, block_size, offset=offset, with_offsets=True),
+                                            columns, offset)
+    else:
+        sentences = conll_lines_iter(decoded_lines(filename, block_size, offset=offset), columns)
+    if prefetch:
+        sentences = prefetch_iter(sentences, queue_depth)
+    for stn in sentences:
+        yield stn
+
+
+def conll_lines_iter(lines, columns=None):
+    """
+    sentences of conll lines from any iterable of text lines, e.g. a pipe or a stage of pipeline.py.
+    :param columns: column projection, as in conll_sentence_iter
+    """
+    maxsplit = -1 if columns is None else max(columns) + 1
+    stn = []
+    for i in lines:
+        i = i.strip()
+        if i == '' or i.startswith('#'):
+            if len(stn):
+                yield stn
+                stn = []
+        else:
+            stn.append(i.split('\t', maxsplit))
+    if len(stn):
+        yield stn
+
+
+def conll_offset_lines_iter(lines, columns=None, offset=0):
+    """
+    conll_lines_iter of (line, byte offset after it) pairs, yields (sentence, byte offset after the line that ends it).
+    a sentence ended by the end of the file ends at the offset of its last line.
+    """
+    maxsplit = -1 if columns is None else max(columns) + 1
+    stn = []
+    for i, offset in lines:
+        i = i.strip()
+        if i == '' or i.startswith('#'):
+            if len(stn):
+                yield stn, offset
+                stn = []
+        else:
+            stn.append(i.split('\t', maxsplit))
+    if len(stn):
+        yield stn, offset
+
+
+def ws_sentence_iter(filename, prefetch=False, block_size=1 << 22, queue_depth=8, offset=0, with_offsets=False):
+    """
+    :param prefetch: read and split the lines in a background thread, see prefetch_iter
+    :param offset: byte offset to start reading at
+    :param with_offsets: yield (tokens, byte offset after the line)
+    """
+    lines = decoded_lines(filename, block_size, offset=offset, with_offsets=with_offsets)
+    if with_offsets:
+        sentences = ((i.split('\t'), end) for i, end in ((line.strip(), end) for line, end in lines) if not i == '')
+    else:
+        sentences = (i.split('\t') for i in (line.strip() for line in lines) if not i == '')
+    if prefetch:
+        sentences = prefetch_iter(sentences, queue_depth)
+    for stn in sentences:
+        yield stn
+
+
+_blank_line = re.compile(rb'\n[ \t\r]*\n')
+_blank_lines = re.compile(rb'(?:[ \t\r]*\n)*')
+
+
+def raw_sentence_iter(filename, block_size=1 << 22):
+    """
+    bytes of each sentence including its ending empty line (comment lines are kept), sliced from large read blocks.
+    memory is bounded by block_size and the longest sentence.
+    """
+    with open(filename, 'rb') as fi:
+        rest = b''
+        while True:
+            block = fi.read(block_size)
+            buf = rest + block
+            pos = _blank_lines.match(buf).end()
+            for m in _blank_line.finditer(buf, pos):
+                yield buf[pos:m.end()]
+                pos = _blank_lines.match(buf, m.end()).end()
+            rest = buf[pos:]
+            if not block:
+                break
+        if rest.strip():
+            yield rest + (b'\n' if rest.endswith(b'\n') else b'\n\n')
+
+
+class ConllCorpus(object):
+    """
+    Random access conll corpus on a memory-mapped file.
+    Byte offsets of the sentences are saved in `filename + '.idx'` and rebuilt when size or mtime of the corpus changes,
+    when the corpus was only appended to, the saved offsets are kept and the file is scanned from its last sentence.
+    only the sentences that are accessed are decoded.
+    Fingerprints of the sentences (see structure.fingerprint) are cached the same way in `filename + '.fp'`.
+        corpus = ConllCorpus('train.conll')
+        len(corpus), corpus[10], corpus[10:20], corpus.raw(10), corpus.fingerprint(10)
+    """
+    INDEX_SUFFIX = '.idx'
+    FINGERPRINT_SUFFIX = '.fp'
+    __magic = b'CONLLID2'
+    __fp_magic = b'CONLL_FP'
+    __header = struct.Struct('<8sQqQ')
+    # crc32 of the last bytes of the indexed file, tells whether a larger file was only appended to.
+    __tail = struct.Struct('<I')
+    TAIL_SIZE = 4096
+
+    def __init__(self, filename, index_file=None, columns=None):
+        """
+        :param columns: column projection of the decoded sentences, as in conll_sentence_iter
+        """
+        self.filename = filename
+        self.maxsplit = -1 if columns is None else max(columns) + 1
+        self.index_file = filename + self.INDEX_SUFFIX if index_file is None else index_file
+        stat = os.stat(filename)
+        self.size, self.mtime = stat.st_size, stat.st_mtime_ns
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        if not self.__load_index():
+            self.starts, self.ends = array('Q'), array('Q')
+            self.__build_index(0)
+            self.__save_index()
+        self.fingerprints = None
+
+    def tail_crc(self, size):
+        """
+        crc32 of the TAIL_SIZE bytes of the corpus before size.
+        """
+        return zlib.crc32(self.mm[max(0, size - self.TAIL_SIZE):size])
+
+    def __load_index(self):
+        """
+        :return: False if the index has to be built from the beginning.
+        """
+        try:
+            with open(self.index_file, 'rb') as f:
+                magic, size, mtime, count = self.__header.unpack(f.read(self.__header.size))
+                tail_crc, = self.__tail.unpack(f.read(self.__tail.size))
+                fresh = size == self.size and mtime == self.mtime
+                appended = 0 < size < self.size and self.tail_crc(size) == tail_crc
+                if not (magic == self.__magic and (fresh or appended)):
+                    return False
+                self.starts, self.ends = array('Q'), array('Q')
+                self.starts.fromfile(f, count)
+                self.ends.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return False
+        if appended:
+            # the last sentence may go on in the appended part, scan again from its start.
+            pos = self.starts.pop() if count else 0
+            if count:
+                self.ends.pop()
+            self.__build_index(pos)
+            self.__save_index()
+        return True
+
+    def __save_index(self):
+        try:
+            with open(self.index_file, 'wb') as f:
+                f.write(self.__header.pack(self.__magic, self.size, self.mtime, len(self.starts)))
+                f.write(self.__tail.pack(self.tail_crc(self.size)))
+                self.starts.tofile(f)
+                self.ends.tofile(f)
+        except OSError:
+            # read only corpus directory, keep the index in memory only.
+            pass
+
+    def __build_index(self, pos):
+        """
+        sentence = lines between empty or '#' lines, [start, end) covers the sentence lines without the last newline.
+        :param pos: offset of a line start to scan from, the sentences found are appended to starts and ends
+        """
+        mm, size = self.mm, self.size
+        start = None
+        while pos < size:
+            nl = mm.find(b'\n', pos)
+            line_end = size if nl == -1 else nl
+            line = mm[pos:line_end].strip()
+            if line == b'' or line.startswith(b'#'):
+                if start is not None:
+                    self.starts.append(start)
+                    self.ends.append(last_end)
+                    start = None
+            else:
+                if start is None:
+                    start = pos
+                last_end = line_end
+            pos = line_end + 1
+        if start is not None:
+            self.starts.append(start)
+            self.ends.append(last_end)
+
+    def __load_fingerprints(self):
+        try:
+            with open(self.filename + self.FINGERPRINT_SUFFIX, 'rb') as f:
+                magic, size, mtime, count = self.__header.unpack(f.read(self.__header.size))
+                if not (magic == self.__fp_magic and size == self.size and mtime == self.mtime and count == len(self)):
+                    return False
+                self.fingerprints = f.read(count * DIGEST_SIZE)
+                return len(self.fingerprints) == count * DIGEST_SIZE
+        except (OSError, struct.error):
+            return False
+
+    def __build_fingerprints(self):
+        self.fingerprints = b''.join([raw_fingerprint(self.raw(i)) for i in range(len(self))])
+        try:
+            with open(self.filename + self.FINGERPRINT_SUFFIX, 'wb') as f:
+                f.write(self.__header.pack(self.__fp_magic, self.size, self.mtime, len(self)))
+                f.write(self.fingerprints)
+        except OSError:
+            pass
+
+    def fingerprint(self, i):
+        """
+        16 bytes fingerprint of the plain text of the i-th sentence, computed for the whole corpus on first use.
+        """
+        if self.fingerprints is None and not self.__load_fingerprints():
+            self.__build_fingerprints()
+        return self.fingerprints[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def raw(self, i):
+        """bytes of the i-th sentence, as they are in the file."""
+        return self.mm[self.starts[i]:self.ends[i]]
+
+    def offset(self, i):
+        return self.starts[i]
+
+    def decode(self, raw):
+        return [line.strip().split('\t', self.maxsplit) for line in raw.decode('utf8').splitlines() if line.strip() != '']
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.decode(self.raw(k)) for k in range(*i.indices(len(self)))]
+        return self.decode(self.raw(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_corpus(filename, columns=None):
+    """
+    :param columns: column projection of a text corpus, the binary corpus has no text to split and ignores it.
+    :return: BinaryCorpus of a binary corpus file (see structure.binary), ConllCorpus otherwise.
+    """
+    return BinaryCorpus(filename) if is_binary(filename) else ConllCorpus(filename, columns=columns)
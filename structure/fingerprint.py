@@ -0,0 +1,31 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Stable 128 bit sentence fingerprint: blake2b of the utf8 plain text (words joined without space).
+    Unlike hash(), the value does not depend on PYTHONHASHSEED, so it can be saved and shared between processes.
+"""
+import hashlib
+
+DIGEST_SIZE = 16
+
+
+def fingerprint(plain):
+    """
+    :param plain: plain text as str or utf8 bytes
+    :return: 16 bytes digest
+    """
+    if isinstance(plain, str):
+        plain = plain.encode('utf8')
+    return hashlib.blake2b(plain, digest_size=DIGEST_SIZE).digest()
+
+
+def raw_plain(raw, word_index=1):
+    """
+    utf8 plain text of a raw conll sentence (bytes without empty lines), nothing is decoded.
+    """
+    return b''.join([line.split(b'\t', word_index + 1)[word_index] for line in raw.split(b'\n')])
+
+
+def raw_fingerprint(raw):
+    return fingerprint(raw_plain(raw))
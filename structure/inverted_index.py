@@ -0,0 +1,349 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Inverted index of a conll corpus, saved in `filename + '.inv'`: term => sorted sentence numbers.
+    terms of a sentence, as utf8 bytes:
+        w:<form>            every word
+        b:<form>\t<form>    every two adjacent words
+        p:<pos>             column 4 and column 5 if not '_'
+        r:<rel>             column 8
+    the byte offsets of the sentence numbers are in the offset index of the corpus (see data_iter.ConllCorpus),
+    so only the matching sentences are read.
+    layout (little endian):
+        header      magic, version, corpus size, corpus mtime (ns), crc32 of the corpus tail, sentence number,
+                    crc32 of the last sentence, segment number, end of the data
+        segments    first sentence, end sentence, dictionary length, postings length,
+                    zlib(dictionary), postings
+    a dictionary entry is varint term length, term, varint postings offset, varint postings length, varint count,
+    a postings list is the varint gaps of the sentence numbers, zlib compressed when it is long (odd length varint).
+    the index is fresh when size and mtime of the corpus did not change, as the offset index of ConllCorpus.
+    each update appends a segment for the new sentences of a corpus that was appended to (its old tail is still
+    there), any other change rebuilds, e.g. an edit that keeps the size.
+"""
+import os
+import re
+import zlib
+import heapq
+import struct
+from array import array
+from collections import defaultdict
+
+MAGIC = b'CONLLINV'
+VERSION = 2
+_header = struct.Struct('<8sIQqIQIIQ')
+_segment = struct.Struct('<QQQQ')
+# postings longer than this are compressed with zlib.
+COMPRESS_SIZE = 256
+TERM_PREFIX = {'w': b'w:', 'form': b'w:', 'b': b'b:', 'bigram': b'b:', 'p': b'p:', 'pos': b'p:', 'r': b'r:', 'rel': b'r:'}
+
+
+def encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varint(data, pos):
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode_postings(ids):
+    out = bytearray()
+    prev = -1
+    for i in ids:
+        encode_varint(i - prev, out)
+        prev = i
+    return bytes(out)
+
+
+def decode_postings(data):
+    ids = []
+    prev = -1
+    n = shift = 0
+    for b in data:
+        n |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            prev += n
+            ids.append(prev)
+            n = shift = 0
+    return ids
+
+
+def sentence_terms(raw):
+    """
+    :param raw: utf8 bytes of a conll sentence
+    :return: set of the terms of the sentence
+    """
+    terms = set()
+    prev = None
+    for line in raw.split(b'\n'):
+        cols = line.strip().split(b'\t')
+        if len(cols) < 2:
+            continue
+        form = cols[1]
+        terms.add(b'w:' + form)
+        if prev is not None:
+            terms.add(b'b:' + prev + b'\t' + form)
+        prev = form
+        for c in (3, 4):
+            if len(cols) > c and not cols[c] == b'_':
+                terms.add(b'p:' + cols[c])
+        if len(cols) > 7 and not cols[7] == b'_':
+            terms.add(b'r:' + cols[7])
+    return terms
+
+
+def intersect(a, b):
+    """intersection of two sorted lists."""
+    if len(a) > len(b):
+        a, b = b, a
+    members = set(b)
+    return [i for i in a if i in members]
+
+
+def union(a, b):
+    """union of two sorted lists."""
+    out = []
+    for i in heapq.merge(a, b):
+        if not out or not out[-1] == i:
+            out.append(i)
+    return out
+
+
+_query_token = re.compile(r'\(|\)|[^\s()]+')
+
+
+def parse_query(text):
+    """
+    'w:中国 AND (p:v OR r:SBV)' => ('AND', [term, ('OR', [term, term])]), AND binds tighter than OR.
+    a term is <kind>:<value>, kind in w/form, b/bigram (value word1+word2), p/pos, r/rel.
+    """
+    tokens = _query_token.findall(text)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def take():
+        pos[0] += 1
+        return tokens[pos[0] - 1]
+
+    def expr():
+        items = [conj()]
+        while peek() == 'OR':
+            take()
+            items.append(conj())
+        return items[0] if len(items) == 1 else ('OR', items)
+
+    def conj():
+        items = [atom()]
+        while peek() == 'AND':
+            take()
+            items.append(atom())
+        return items[0] if len(items) == 1 else ('AND', items)
+
+    def atom():
+        token = peek()
+        if token is None:
+            raise ValueError('query ends too early: %s' % text)
+        take()
+        if token == '(':
+            node = expr()
+            if not peek() == ')':
+                raise ValueError('missing ) in query: %s' % text)
+            take()
+            return node
+        return term(token)
+
+    node = expr()
+    if peek() is not None:
+        raise ValueError('unexpected %s in query: %s' % (peek(), text))
+    return node
+
+
+def term(token):
+    kind, sep, value = token.partition(':')
+    if not sep or kind not in TERM_PREFIX or not value:
+        raise ValueError('bad query term %s, use w:, b:, p: or r:' % token)
+    value = value.encode('utf8')
+    if TERM_PREFIX[kind] == b'b:':
+        first, plus, second = value.partition(b'+')
+        if not plus:
+            raise ValueError('bigram term is b:word1+word2: %s' % token)
+        value = first + b'\t' + second
+    return TERM_PREFIX[kind] + value
+
+
+class InvertedIndex(object):
+    """
+        index = InvertedIndex(ConllCorpus('train.conll'))
+        index.update()
+        index.query('w:中国 AND p:v')  => sorted sentence numbers
+    """
+    SUFFIX = '.inv'
+
+    def __init__(self, corpus, filename=None):
+        self.corpus = corpus
+        self.filename = corpus.filename + self.SUFFIX if filename is None else filename
+        self.dictionary = None
+
+    def __state(self):
+        n = len(self.corpus)
+        last_crc = zlib.crc32(self.corpus.raw(n - 1)) if n else 0
+        mtime = getattr(self.corpus, 'mtime', None)
+        if mtime is None:
+            mtime = os.stat(self.corpus.filename).st_mtime_ns
+        return self.corpus.size, mtime, self.__tail_crc(self.corpus.size), n, last_crc
+
+    def __tail_crc(self, size):
+        if hasattr(self.corpus, 'tail_crc'):
+            return self.corpus.tail_crc(size)
+        return 0
+
+    def __read_header(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                fields = _header.unpack(f.read(_header.size))
+        except (OSError, struct.error):
+            return None
+        if not (fields[0] == MAGIC and fields[1] == VERSION):
+            return None
+        return fields[2:]
+
+    def update(self):
+        """
+        make the index match the corpus.
+        :return: number of the sentences indexed by this call
+        """
+        size, mtime, tail_crc, n, last_crc = self.__state()
+        header = self.__read_header()
+        if header is not None:
+            old_size, old_mtime, old_tail, old_n, old_last, segments, data_end = header
+            if (old_size, old_mtime, old_tail, old_n, old_last) == (size, mtime, tail_crc, n, last_crc):
+                return 0
+            # appended: the old tail is still there and the last old sentence did not go on.
+            if (hasattr(self.corpus, 'tail_crc') and 0 < old_size < size and old_n <= n
+                    and old_tail == self.__tail_crc(old_size)
+                    and old_n > 0 and zlib.crc32(self.corpus.raw(old_n - 1)) == old_last):
+                with open(self.filename, 'r+b') as f:
+                    f.seek(data_end)
+                    self.__write_segment(f, old_n, n)
+                    data_end = f.tell()
+                    f.truncate()
+                    f.seek(0)
+                    f.write(_header.pack(MAGIC, VERSION, size, mtime, tail_crc, n, last_crc, segments + 1, data_end))
+                self.dictionary = None
+                return n - old_n
+        with open(self.filename, 'wb') as f:
+            f.write(_header.pack(MAGIC, VERSION, size, mtime, tail_crc, n, last_crc, 0, 0))
+            self.__write_segment(f, 0, n)
+            data_end = f.tell()
+            f.seek(0)
+            f.write(_header.pack(MAGIC, VERSION, size, mtime, tail_crc, n, last_crc, 1, data_end))
+        self.dictionary = None
+        return n
+
+    def __write_segment(self, f, begin, end):
+        postings = defaultdict(lambda: array('I'))
+        for i in range(begin, end):
+            for t in sentence_terms(self.corpus.raw(i)):
+                postings[t].append(i)
+        dictionary, data = bytearray(), bytearray()
+        for t in sorted(postings):
+            ids = postings[t]
+            encoded = encode_postings(ids)
+            if len(encoded) > COMPRESS_SIZE:
+                encoded = zlib.compress(encoded)
+                flag = 1
+            else:
+                flag = 0
+            encode_varint(len(t), dictionary)
+            dictionary += t
+            encode_varint(len(data), dictionary)
+            encode_varint(len(encoded) * 2 + flag, dictionary)
+            encode_varint(len(ids), dictionary)
+            data += encoded
+        dictionary = zlib.compress(bytes(dictionary))
+        f.write(_segment.pack(begin, end, len(dictionary), len(data)))
+        f.write(dictionary)
+        f.write(data)
+
+    def __load(self):
+        """
+        read the dictionaries of all segments: term => [(postings file offset, length, compressed, count)]
+        """
+        header = self.__read_header()
+        if header is None:
+            raise ValueError('no inverted index %s, run update first.' % self.filename)
+        segments = header[5]
+        self.dictionary = defaultdict(list)
+        with open(self.filename, 'rb') as f:
+            f.seek(_header.size)
+            for _ in range(segments):
+                begin, end, dict_len, data_len = _segment.unpack(f.read(_segment.size))
+                dictionary = zlib.decompress(f.read(dict_len))
+                data_pos = f.tell()
+                pos = 0
+                while pos < len(dictionary):
+                    length, pos = decode_varint(dictionary, pos)
+                    t = dictionary[pos:pos + length]
+                    pos += length
+                    offset, pos = decode_varint(dictionary, pos)
+                    size, pos = decode_varint(dictionary, pos)
+                    count, pos = decode_varint(dictionary, pos)
+                    self.dictionary[t].append((data_pos + offset, size >> 1, size & 1, count))
+                f.seek(data_pos + data_len)
+
+    def count(self, t):
+        """number of sentences containing term t (bytes)."""
+        if self.dictionary is None:
+            self.__load()
+        return sum([entry[3] for entry in self.dictionary.get(t, [])])
+
+    def postings(self, t):
+        """sorted sentence numbers of term t (bytes)."""
+        if self.dictionary is None:
+            self.__load()
+        ids = []
+        with open(self.filename, 'rb') as f:
+            # segments cover increasing sentence ranges, their lists are concatenated.
+            for offset, size, compressed, count in self.dictionary.get(t, []):
+                f.seek(offset)
+                data = f.read(size)
+                ids += decode_postings(zlib.decompress(data) if compressed else data)
+        return ids
+
+    def evaluate(self, node):
+        if isinstance(node, bytes):
+            return self.postings(node)
+        op, items = node
+        if op == 'AND':
+            # the rarest terms first, the result only shrinks.
+            items = sorted(items, key=lambda i: self.count(i) if isinstance(i, bytes) else float('inf'))
+            result = self.evaluate(items[0])
+            for item in items[1:]:
+                if not result:
+                    break
+                result = intersect(result, self.evaluate(item))
+            return result
+        result = []
+        for item in items:
+            result = union(result, self.evaluate(item))
+        return result
+
+    def query(self, text):
+        """
+        :return: sorted sentence numbers matching the query, see parse_query
+        """
+        return self.evaluate(parse_query(text))
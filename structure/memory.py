@@ -0,0 +1,14 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+import sys
+import resource
+
+
+def peak_rss_mb():
+    """
+    peak resident set size of this process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS reports bytes.
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
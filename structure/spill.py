@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Hash partitioned spill files for set operations on corpora larger than memory.
+    A record is (source no, sentence no, key, raw sentence bytes), all the records of a key go to one partition,
+    so each partition can be processed in memory on its own.
+"""
+import os
+import zlib
+import heapq
+import struct
+import shutil
+import tempfile
+
+
+class SpillPartitions(object):
+    __record = struct.Struct('<HQII')
+    # the source no is a uint16 of the record.
+    MAX_SOURCES = 0xFFFF + 1
+
+    def __init__(self, partitions, tmp_dir=None):
+        self.partitions = partitions
+        self.dir = tempfile.mkdtemp(prefix='conll_spill_', dir=tmp_dir)
+        self.files = [open(self.__path(p), 'wb') for p in range(partitions)]
+
+    def __path(self, p):
+        return os.path.join(self.dir, 'part%d' % p)
+
+    def partition_of(self, key):
+        return zlib.crc32(key) % self.partitions
+
+    @classmethod
+    def write_record(cls, f, source, seq, key, raw):
+        f.write(cls.__record.pack(source, seq, len(key), len(raw)))
+        f.write(key)
+        f.write(raw)
+
+    @classmethod
+    def read_records(cls, filename):
+        size = cls.__record.size
+        with open(filename, 'rb') as f:
+            while True:
+                header = f.read(size)
+                if len(header) < size:
+                    return
+                source, seq, key_len, raw_len = cls.__record.unpack(header)
+                key = f.read(key_len)
+                yield source, seq, key, f.read(raw_len)
+
+    def add(self, source, seq, key, raw):
+        self.write_record(self.files[self.partition_of(key)], source, seq, key, raw)
+
+    def __iter__(self):
+        """
+        :return: generator of the record generator of each partition
+        """
+        for f in self.files:
+            f.close()
+        for p in range(self.partitions):
+            yield self.read_records(self.__path(p))
+
+    def run_file(self, name):
+        return os.path.join(self.dir, name)
+
+    def cleanup(self):
+        for f in self.files:
+            f.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def merge_runs(run_files):
+    """
+    k-way merge of sorted run files (written with SpillPartitions.write_record) on (source no, sentence no).
+    :return: generator of (source, seq, key, raw)
+    """
+    return heapq.merge(*[SpillPartitions.read_records(f) for f in run_files], key=lambda r: (r[0], r[1]))
@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*_
+# Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
+"""
+    Tree validity and projectivity check on the head array of a sentence, no word object is needed.
+    heads[0] is the root (value ignored), heads[i] is the head position of the i-th word.
+"""
+from collections import namedtuple
+
+
+class TreeCheck(namedtuple('TreeCheck', ['roots', 'acyclic', 'non_projective'])):
+    """
+    roots: number of words attached to the root.
+    acyclic: all heads in range and every word reaches the root.
+    non_projective: [(dependent, head)] arcs crossed by another arc, None when the heads are not a tree.
+    """
+    __slots__ = ()
+
+    def is_valid(self, single_root=False):
+        return self.acyclic and not self.non_projective and (not single_root or self.roots == 1)
+
+
+def heads_of_lines(stn, parent_index=6):
+    """
+    head array of a sentence given as split conll lines.
+    raise ValueError if the word index column is not 1..n or a head is not a number.
+    """
+    heads = [-1]
+    for i, line in enumerate(stn, 1):
+        if not int(line[0]) == i:
+            raise ValueError('word index %s at position %d' % (line[0], i))
+        heads.append(int(line[parent_index]))
+    return heads
+
+
+def count_roots(heads):
+    return sum([1 for h in heads[1:] if h == 0])
+
+
+def check_acyclic(heads):
+    """
+    iterative walk to the root, each word is visited once: O(n).
+    """
+    l = len(heads)
+    # 0: not visited, 1: on current path, 2: reach root
+    state = [0] * l
+    state[0] = 2
+    for i in range(1, l):
+        path = []
+        cur = i
+        while state[cur] == 0:
+            state[cur] = 1
+            path.append(cur)
+            cur = heads[cur]
+            if cur < 0 or cur >= l:
+                return False
+        if state[cur] == 1:
+            return False
+        for p in path:
+            state[p] = 2
+    return True
+
+
+def non_projective_arcs(heads):
+    """
+    arc (l, r) is crossed iff a word strictly inside has an arc to a word outside [l, r].
+    lo[k] / hi[k] are the farthest ends of the arcs touching word k, the range min / max inside every arc is answered
+    by a sparse table: O(n log n). heads must be in range.
+    :return: [(dependent, head)] in dependent order
+    """
+    l = len(heads)
+    lo = list(range(l))
+    hi = list(range(l))
+    for d in range(1, l):
+        h = heads[d]
+        if h < lo[d]:
+            lo[d] = h
+        if h > hi[d]:
+            hi[d] = h
+        if d < lo[h]:
+            lo[h] = d
+        if d > hi[h]:
+            hi[h] = d
+    mins, maxs = [lo], [hi]
+    step = 1
+    while step * 2 <= l:
+        pmin, pmax = mins[-1], maxs[-1]
+        mins.append([min(pmin[i], pmin[i + step]) for i in range(l - step * 2 + 1)])
+        maxs.append([max(pmax[i], pmax[i + step]) for i in range(l - step * 2 + 1)])
+        step *= 2
+    arcs = []
+    for d in range(1, l):
+        h = heads[d]
+        left, right = (d, h) if d < h else (h, d)
+        begin, end = left + 1, right - 1
+        if begin > end:
+            continue
+        level = (end - begin + 1).bit_length() - 1
+        width = 1 << level
+        if min(mins[level][begin], mins[level][end - width + 1]) < left or \
+                max(maxs[level][begin], maxs[level][end - width + 1]) > right:
+            arcs.append((d, h))
+    return arcs
+
+
+def check_heads(heads):
+    """
+    :return: TreeCheck of the head array
+    """
+    acyclic = check_acyclic(heads)
+    return TreeCheck(count_roots(heads), acyclic, non_projective_arcs(heads) if acyclic else None)
@@ -2,36 +2,28 @@
 # -*- coding: utf-8 -*_
 # Copyright (C) 2018 Liu Yang <mkliuyang@gmail.com> All rights reserved.
 import math
-import copy
+import sys
+from array import array
 
-SPLIT_CHAR = '\t'
-
-
-class PlainWord(object):
-    def __init__(self, word):
-        self.word = word
-        self.next = None
-        self.pre = None
-
-    def __len__(self):
-        return len(self.word)
-
-    def __str__(self):
-        return self.word
+from structure.tree_check import check_acyclic, non_projective_arcs
+from structure.fingerprint import fingerprint
+from structure.core import SPLIT_CHAR, PlainWord, Token, TokenSentence
 
 
 class WordWithPos(PlainWord):
+    __slots__ = ('pos',)
 
     def __init__(self, word, pos):
         super().__init__(word)
         self.pos = pos
 
 
-class WordWithRel(PlainWord):
-    __idx_index = 0
-    __word_index = 1
-    __parent_index = 6
-    __rel_index = 7
+class WordWithRel(Token):
+    """
+    token of structure.core with the rel column, parsed strictly: a line without a head or rel is an error.
+    """
+    __slots__ = ('origin', 'rel')
+    rel_index = 7
 
     @classmethod
     def construct_with_line(cls, line):
@@ -50,26 +42,32 @@ class WordWithRel(PlainWord):
             raise ValueError("Error input.")
 
     def __init_with_line(self, line):
-        if line[self.__word_index] == '<ROOT>':
+        if line[self.word_index] == '<ROOT>':
             self.__init_with_args(0, '<ROOT>', None, None)
             return
-        length_check = max([self.__idx_index, self.__word_index, self.__parent_index, self.__rel_index])
+        length_check = max([self.idx_index, self.word_index, self.parent_index, self.rel_index])
         if len(line) <= length_check:
             raise ValueError('Input line mast longer than %d' % length_check)
         self.__init_with_args(
-            int(line[self.__idx_index]),
-            line[self.__word_index],
-            int(line[self.__parent_index]),
-            line[self.__rel_index])
-        self.line = copy.deepcopy(line)
+            int(line[self.idx_index]),
+            line[self.word_index],
+            int(line[self.parent_index]),
+            line[self.rel_index])
+        # the word owns the input line from here on, conll_str writes into it once the word is changed.
+        self.line = line
+        # fields as read, a word still equal to them is written back as its line.
+        if line[self.idx_index] == str(self.index) and line[self.parent_index] == str(self.parent):
+            self.origin = (self.index, self.word, self.parent, self.rel)
 
     def __init_with_args(self, index, word, parent, rel):
-        super().__init__(word)
+        PlainWord.__init__(self, word)
         self.line = None
+        self.origin = None
         self.index = index
         self.parent = parent
         self.rel = rel
-        self.children = []
+        self.func = None
+        self._children = []
 
     def __str__(self):
         if self.parent is None: # skip root
@@ -81,35 +79,20 @@ class WordWithRel(PlainWord):
             self.line = ['_'] * 10
         if self.parent is None: # skip root
             return ''
-        self.line[self.__idx_index] = str(self.index)
-        self.line[self.__word_index] = self.word
-        self.line[self.__parent_index] = str(self.parent.index)
-        self.line[self.__rel_index] = self.rel
+        if self.origin == (self.index, self.word, self.parent.index, self.rel):
+            return SPLIT_CHAR.join(self.line) + '\n'
+        self.line[self.idx_index] = str(self.index)
+        self.line[self.word_index] = self.word
+        self.line[self.parent_index] = str(self.parent.index)
+        self.line[self.rel_index] = self.rel
         return SPLIT_CHAR.join(self.line) + '\n'
 
 
-    def reach_and_reach_children(self, reach, maxdeep, depth=0):
-        reach[self.index] = True
-        if depth > maxdeep:
-            raise RuntimeError('circle in tree.')
-        for word in self.children:
-            word.reach_and_reach_children(reach, maxdeep, depth + 1)
-
-    def check_projective(self):
-        if self.parent.index < self.index:
-            min = self.parent.index
-            max = self.index
-            next = 'pre'
-        else:
-            min = self.index
-            max = self.parent.index
-            next = 'next'
-        cur = self.__getattribute__(next)
-        while not (cur.index == self.parent.index):
-            if cur.parent.index < min or cur.parent.index > max:
-                return False
-            cur = cur.__getattribute__(next)
-        return True
+def plain_hash(plain):
+    """
+    stable 128 bit hash of the plain text, see structure.fingerprint.
+    """
+    return int.from_bytes(fingerprint(plain), 'little')
 
 
 class Sentence(object):
@@ -121,63 +104,164 @@ class Sentence(object):
         return ''.join([str(w) for w in self.iter_item()])
 
     def plain_hash(self):
-        return hash(self.plain())
+        return plain_hash(self.plain())
 
 
-class SentenceAsTree(Sentence):
+class SentenceAsTree(TokenSentence, Sentence):
+    """
+    linked tree of WordWithRel, linking, re_index and iteration are the ones of structure.core.TokenSentence.
+    """
+    token_class = WordWithRel
 
     def __init__(self, stn):
-        self.root = WordWithRel(['0', '<ROOT>'])
-        words = [self.root]
-        for i in stn:
-            words.append(WordWithRel(i))
-        # manage parents
-        for i in words:
-            i.parent = words[i.parent] if i.parent is not None else None
-        # manage pre next children
-        for i in words:
-            i.next = words[i.index + 1] if i.index + 1 < len(words) else None
-            i.pre = words[i.index - 1] if i.index - 1 >= 0 else None
-            if not i.parent is None:
-                i.parent.children.append(i)
-
-    def re_index(self):
-        i = 0
-        for w in self.iter_item():
-            w.index = i
-            i += 1
+        TokenSentence.__init__(self, stn)
 
-    def iter_item(self):
-        cur = self.root
-        while cur is not None:
-            yield cur
-            cur = cur.next
+    def head_array(self):
+        """
+        head array by position in the word chain, position 0 is the root.
+        """
+        words = list(self.iter_item())
+        position = {id(w): i for i, w in enumerate(words)}
+        return [-1] + [position.get(id(w.parent), -1) for w in words[1:]]
 
     def check_tree(self):
-        l = len(self)
-        reach = [False] * l
-        self.root.reach_and_reach_children(reach, l)
-        return all(reach)
+        return check_acyclic(self.head_array())
 
     def check_projective(self):
-        for w in self.iter_item():
-            if w.word == '<ROOT>':
-                continue
-            if not w.check_projective():
-                return False
-        return True
+        return len(non_projective_arcs(self.head_array())) == 0
 
     def plain(self):
         return ''.join([w.word for w in self.iter_item() if not w.word == '<ROOT>'])
 
+    def conll_str(self):
+        return ''.join([i.conll_str() for i in self.iter_item()])
+
+
+class WordView(object):
+    """
+    token view of a SentenceAsArray, only created when a caller asks for it.
+    """
+    __slots__ = ('sentence', 'position')
+
+    def __init__(self, sentence, position):
+        self.sentence = sentence
+        self.position = position
+
+    @property
+    def index(self):
+        return self.sentence.index[self.position]
+
+    @property
+    def word(self):
+        return self.sentence.forms[self.position]
+
+    @property
+    def rel(self):
+        return self.sentence.rels[self.position]
+
+    @property
+    def line(self):
+        if self.position == 0:
+            return None
+        return self.sentence.rows[self.position - 1]
+
+    @property
+    def parent(self):
+        head = self.sentence.heads[self.position]
+        return None if head < 0 else WordView(self.sentence, head)
+
+    @property
+    def pre(self):
+        return WordView(self.sentence, self.position - 1) if self.position > 0 else None
+
+    @property
+    def next(self):
+        return WordView(self.sentence, self.position + 1) if self.position + 1 < len(self.sentence) else None
+
+    @property
+    def children(self):
+        heads = self.sentence.heads
+        return [WordView(self.sentence, i) for i in range(1, len(heads)) if heads[i] == self.position]
+
+    def __eq__(self, other):
+        return isinstance(other, WordView) and other.sentence is self.sentence and other.position == self.position
+
+    def __hash__(self):
+        return hash((id(self.sentence), self.position))
+
     def __len__(self):
-        return len([1 for i in self.iter_item()])
+        return len(self.word)
 
     def __str__(self):
-        return ''.join([str(i) for i in self.iter_item()])
+        if self.position == 0:  # skip root
+            return ''
+        return '%d %s %d %s\n' % (self.index, self.word, self.sentence.index[self.sentence.heads[self.position]], self.rel)
+
+
+class SentenceAsArray(Sentence):
+    """
+    Columnar sentence: index, form, head and rel are kept as parallel arrays (position 0 is the root),
+    the other columns stay in the input rows. No per-token object is built unless asked by `word` or `iter_item`.
+    """
+    __idx_index = 0
+    __word_index = 1
+    __parent_index = 6
+    __rel_index = 7
+
+    def __init__(self, stn):
+        length_check = max([self.__idx_index, self.__word_index, self.__parent_index, self.__rel_index])
+        self.rows = stn
+        self.index = array('i', [0])
+        self.heads = array('i', [-1])
+        self.forms = ['<ROOT>']
+        self.rels = [None]
+        for line in stn:
+            if len(line) <= length_check:
+                raise ValueError('Input line mast longer than %d' % length_check)
+            self.index.append(int(line[self.__idx_index]))
+            self.heads.append(int(line[self.__parent_index]))
+            self.forms.append(sys.intern(line[self.__word_index]))
+            self.rels.append(sys.intern(line[self.__rel_index]))
+
+    def word(self, position):
+        return WordView(self, position)
+
+    def iter_item(self):
+        for i in range(len(self.forms)):
+            yield WordView(self, i)
+
+    def to_tree(self):
+        return SentenceAsTree(self.rows)
+
+    def check_tree(self):
+        return check_acyclic(self.heads)
+
+    def check_projective(self):
+        return len(non_projective_arcs(self.heads)) == 0
+
+    def plain(self):
+        return ''.join(self.forms[1:])
+
+    def __len__(self):
+        return len(self.forms)
+
+    def __str__(self):
+        return ''.join([str(w) for w in self.iter_item()])
 
     def conll_str(self):
-        return ''.join([i.conll_str() for i in self.iter_item()])
+        """
+        forms and rels never change, a row is written as it is unless its index or head is not in the normal form.
+        """
+        index, heads = self.index, self.heads
+        out = []
+        for i, line in enumerate(self.rows, 1):
+            idx, head = str(index[i]), str(index[heads[i]])
+            if not (line[self.__idx_index] == idx and line[self.__parent_index] == head):
+                line = list(line)
+                line[self.__idx_index] = idx
+                line[self.__parent_index] = head
+            out.append(SPLIT_CHAR.join(line) + '\n')
+        return ''.join(out)
 
 
 class SentenceAsList(Sentence):